@@ -1,4 +1,4 @@
-from typing import List, Tuple, Dict, Optional
+from typing import List, Tuple, Dict, Optional, Any
 from Question import Question
 from Status import Status, checkStatus
 from datetime import datetime
@@ -60,6 +60,30 @@ Attributes:
         self._contact = contact
         self._sql_questions = Election.makeQuestionTuples(questions, election_id)
 
+    def toDict(self) -> Dict[str, Any]:
+        """
+        Returns the Election as a dictionary of JSON-friendly types (apart from
+        the datetimes, which orjson handles) that can be turned back into an
+        Election with Election.fromDict().
+        """
+        return {
+            "election_id": self.election_id,
+            "title": self.title,
+            "questions": [question.toDict() for question in self.questions],
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "contact": self.contact
+            }
+
+    def fromDict(data: Dict[str, Any]) -> 'Election':
+        """Returns the Election described by a dictionary from toDict()."""
+        return Election(data['election_id'], data['title'],
+                        [Question.fromDict(question) \
+                         for question in data['questions']],
+                        datetime.fromisoformat(data['start_time']),
+                        datetime.fromisoformat(data['end_time']),
+                        data['contact'])
+
     def getQuestion(self, question_id: str) -> Optional[Question]:
         """
         Given a question ID, returns the appropriate question object or None if
@@ -1,9 +1,11 @@
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Any
 
 from gmpy2 import mpz
 from ecdsa import NIST256p
 from ecdsa.ellipticcurve import Point
 
+from crypto import precomputePoint
+
 class Question:
     """
 This class is responsible for storing the data needed to display a
@@ -32,11 +34,33 @@ Attributes:
         self._query = query
         self._max_answers = max_answers
         self._choices = choices
-        self._gen_1 = NIST256p.generator
-        self._gen_2 = gen_2
+        # every ballot for this question multiplies by gen_2 several times
+        self._gen_2 = precomputePoint(gen_2)
         self._sql_choices = [(question_id, i, choices[i]) \
                              for i in range(len(choices))]
 
+    def toDict(self) -> Dict[str, Any]:
+        """
+        Returns the Question as a dictionary of JSON-friendly types that can be
+        turned back into a Question with Question.fromDict().
+        """
+        from helpers import pointToBytestr
+        return {
+            "question_id": self.question_id,
+            "election_id": self.election_id,
+            "query": self.query,
+            "max_answers": self.max_answers,
+            "choices": self.choices,
+            "gen_2": pointToBytestr(self.gen_2)
+            }
+
+    def fromDict(data: Dict[str, Any]) -> 'Question':
+        """Returns the Question described by a dictionary from toDict()."""
+        from helpers import bytestrToPoint
+        return Question(data['question_id'], data['election_id'],
+                        data['query'], data['max_answers'], data['choices'],
+                        bytestrToPoint(data['gen_2']))
+
     @property
     def question_id(self) -> str:
         return self._question_id
@@ -59,7 +83,9 @@ Attributes:
 
     @property
     def gen_1(self) -> Point:
-        return self._gen_1
+        # not stored on the object since it is the same for every Question and
+        # carries a large precomputation table once it has been used
+        return NIST256p.generator
 
     @property
     def gen_2(self) -> Point:
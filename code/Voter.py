@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Dict, Any
 
 class Voter():
     """This class wraps each voter's data whenever we insert or extra from the
@@ -13,6 +14,10 @@ Attributes:
 - dob         -- voter's date of birth
 - voted       -- whether or not this Voter has completed the election
 """
+    # one Voter is made per row of the voter CSV file, so use slots rather than
+    # a __dict__ per instance
+    __slots__ = ('_voter_id', '_election_id', '_name', '_postcode', '_uname',
+                 '_dob', '_voted', '_hash', '_current')
 
     # Constructor
     def __init__(self, voter_id: str, election_id: str, name: str,
@@ -28,6 +33,31 @@ Attributes:
         self._hash = hash
         self._current = current_q
 
+    def toDict(self) -> Dict[str, Any]:
+        """
+        Returns the Voter as a dictionary of JSON-friendly types (apart from
+        the date of birth, which orjson handles) that can be turned back into a
+        Voter with Voter.fromDict().
+        """
+        return {
+            "voter_id": self.voter_id,
+            "election_id": self.election_id,
+            "name": self.name,
+            "postcode": self.postcode,
+            "uname": self.uname,
+            "dob": self.dob,
+            "hash": self.hash,
+            "voted": self.voted,
+            "current": self.current
+            }
+
+    def fromDict(data: Dict[str, Any]) -> 'Voter':
+        """Returns the Voter described by a dictionary from toDict()."""
+        return Voter(data['voter_id'], data['election_id'], data['name'],
+                     data['postcode'], data['uname'],
+                     datetime.fromisoformat(data['dob']), data['hash'],
+                     data['voted'], data['current'])
+
     def nextQuestion(self) -> None:
         """Increments the question counter for the voter"""
         self._current += 1
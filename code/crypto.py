@@ -1,13 +1,19 @@
 import gmpy2
 from gmpy2 import mpz, powmod, divexact
 from ecdsa import NIST256p, SigningKey, VerifyingKey
-from ecdsa.ellipticcurve import Point, INFINITY
+from ecdsa.ellipticcurve import Point, PointJacobi, INFINITY
 from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.utils import (decode_dss_signature,
+                                                             encode_dss_signature)
+from cryptography.exceptions import InvalidSignature
 
 import json
+import hashlib
 from secrets import randbelow
 from base64 import b64encode
-from typing import Tuple, List, Optional
+from functools import lru_cache
+from typing import Tuple, List, Optional, Union
 
 # first generator, g, instantiated with domain parameters of NIST
 # ecdsa.ellipticcurve.PointJacobi
@@ -24,24 +30,63 @@ q = mpz(curve.p())
 cofactor = mpz(curve.cofactor())
 n = mpz(g1.order())
 
-def hashString(string: str) -> str:
-    """Returns hex representation of input string hashes with SHA-512"""
-    digest = hashes.Hash(hashes.SHA512())
-    digest.update(bytes(string, 'utf-8'))
-    return digest.finalize().hex()
+# signing and verifying is done by OpenSSL, but signatures keep the format the
+# ecdsa package uses (raw r || s over a SHA-1 digest) so that those already
+# stored or published still verify
+SIGNATURE_ALGORITHM = ec.ECDSA(hashes.SHA1())
+
+# number of bytes in each of r and s in a signature
+SIGNATURE_INT_BYTES = 32
+
+def hashString(string: Union[str, bytes]) -> str:
+    """
+    Returns hex representation of input string hashes with SHA-512. Strings
+    already encoded as UTF-8 bytes are hashed as they are.
+    """
+    if isinstance(string, str):
+        string = string.encode('utf-8')
+    return hashlib.sha512(string).hexdigest()
+
+@lru_cache(maxsize=8)
+def opensslSigningKey(key_bytes: bytes) -> ec.EllipticCurvePrivateKey:
+    """Returns the OpenSSL version of a SigningKey from its byte-encoding."""
+    return ec.derive_private_key(int.from_bytes(key_bytes, 'big'),
+                                 ec.SECP256R1())
+
+@lru_cache(maxsize=8)
+def opensslVerifyingKey(key_bytes: bytes) -> ec.EllipticCurvePublicKey:
+    """Returns the OpenSSL version of a VerifyingKey from its byte-encoding."""
+    return ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(),
+                                                        b'\x04' + key_bytes)
 
 def signData(string: str, private: SigningKey) -> str:
     """
     Signs the passed string with the stored private key, return as hex string.
     """
-    return private.sign(bytes(string, 'utf-8')).hex()
+    r, s = decode_dss_signature(opensslSigningKey(private.to_string()).sign(
+        bytes(string, 'utf-8'), SIGNATURE_ALGORITHM))
+    return (r.to_bytes(SIGNATURE_INT_BYTES, 'big') +
+            s.to_bytes(SIGNATURE_INT_BYTES, 'big')).hex()
 
 def verifyData(data: str, key: VerifyingKey, signature: str) -> bool:
     """
     Verifies that some given data was signed with the SigningKey paired with
     the passed VerifyingKey based on a signature in hex form.
     """
-    return key.verify(bytes.fromhex(signature), bytes(data, 'utf-8'))
+    try:
+        raw = bytes.fromhex(signature)
+    except ValueError:
+        return False
+    if len(raw) != 2 * SIGNATURE_INT_BYTES:
+        return False
+    der = encode_dss_signature(int.from_bytes(raw[:SIGNATURE_INT_BYTES], 'big'),
+                               int.from_bytes(raw[SIGNATURE_INT_BYTES:], 'big'))
+    try:
+        opensslVerifyingKey(key.to_string()).verify(der, bytes(data, 'utf-8'),
+                                                    SIGNATURE_ALGORITHM)
+        return True
+    except InvalidSignature:
+        return False
 
 def generateKeyPair() -> Tuple[mpz, mpz]:
     """Generates a public/private key pair for the current curve."""
@@ -55,7 +100,7 @@ def hashElectionString(election_string: str, count: int = None) -> mpz:
     the current iteration of the parent loop, and the generator for the curve
     being used.
     """
-    digest = hashes.Hash(hashes.SHA256())
+    digest = hashlib.sha256()
     digest.update(bytes.fromhex(hex(a)[2:]))
     digest.update(bytes.fromhex(hex(b)[2:]))
     digest.update(bytes(str(cofactor), 'utf-8'))
@@ -67,7 +112,7 @@ def hashElectionString(election_string: str, count: int = None) -> mpz:
     digest.update(bytes(election_string, 'utf-8'))
     if count is not None:
         digest.update(bytes(str(count), 'utf-8'))
-    return mpz(int.from_bytes(digest.finalize(), byteorder="big"))
+    return mpz(int.from_bytes(digest.digest(), byteorder="big"))
 
 def eulerCriterion(num: mpz) -> bool:
     """Euler's criterion. q is an odd prime > 2. https://en.wikipedia.org/wiki/Euler%27s_criterion"""
@@ -106,6 +151,16 @@ def generateRandSecret() -> mpz:
         r = randbelow(n)
     return mpz(r)
 
+def precomputePoint(point: Point) -> PointJacobi:
+    """
+    Returns a copy of a point that builds a table of its multiples the first
+    time it is multiplied, which makes later multiplications by it around 7x
+    faster. Use this for points multiplied many times, like a question's
+    second generator.
+    """
+    return PointJacobi.from_affine(Point(curve, point.x(), point.y(), n),
+                                   generator=True)
+
 def generateR(g2: Point, r: mpz) -> Point:
     """Returns a Point p = g2^rand"""
     return g2 * r
@@ -1,13 +1,17 @@
 import sqlite3
 import os
-import json
+import threading
+import orjson
 from typing import Optional, List, Tuple, Dict, Any
+from itertools import groupby
+from operator import itemgetter
 from ast import literal_eval
 from base64 import b64decode
+from datetime import datetime
 
 from helpers import (validateHash, bytestrToPoint, pointToBytestr,
                      generateSession, parseTime, bytestrToSKey, sKeyToBytestr,
-                     hexToMpz, truncHash, hexToString, prettyReceipt)
+                     hexToMpz, truncHash, loadReceiptJson, prettyReceipt)
 from Election import Election
 from Voter import Voter
 from Status import Status, checkStatus
@@ -21,28 +25,118 @@ from ecdsa.ellipticcurve import Point
 from flask import Flask, current_app, g, flash, Markup
 from flask.cli import with_appcontext
 
+# size of each connection's prepared statement cache; every query here uses ?
+# placeholders so repeated calls reuse the parsed statement
+CACHED_STATEMENTS = 256
+
+# open connections by database path for each thread, so that a connection's
+# settings and statement cache are kept across requests rather than being set
+# up again for each one
+local_connections = threading.local()
+
+# parsed private keys by database path, so the key is read and parsed once per
+# process rather than on every vote. Restart the app after running init-keys
+# from another process so it picks up the new key.
+private_keys: Dict[str, SigningKey] = {}
+
+# Election objects, start/end times, contacts, question counts and Question
+# objects by database path and election ID (and question number). Elections
+# cannot be edited once they are inserted, so these never go stale;
+# clearElectionCaches() empties them after init-db.
+elections: Dict[Tuple[str, str], Election] = {}
+election_times: Dict[Tuple[str, str], Tuple[datetime, datetime]] = {}
+election_questions: Dict[Tuple[str, str, int], Question] = {}
+election_contacts: Dict[Tuple[str, str], str] = {}
+question_counts: Dict[Tuple[str, str], int] = {}
+
+# bulletin board ballots and choice tallies of CLOSED elections by database
+# path and election ID; no more votes can be cast once an election has closed,
+# so these are final (also emptied by clearElectionCaches())
+closed_ballots: Dict[Tuple[str, str], Dict[str, List[dict]]] = {}
+closed_tallies: Dict[Tuple[str, str], Dict[str, List[Tuple]]] = {}
+
+# voters inserted per multi-row INSERT statement (7 parameters each, so well
+# under SQLite's default limit of 999 parameters per statement)
+VOTER_INSERT_BATCH = 100
+
+# columns and placeholders for one voter row in insertElection()
+VOTER_COLUMNS = """voters (voter_id, election_id, pass_hash, full_name, dob,
+                postcode, uname, finished_voting, current_question)"""
+VOTER_VALUES = "(?, ?, ?, ?, ?, ?, ?, 0, 1)"
+
+# idempotent schema changes, run after schema.sql by 'init-db' and on their
+# own by 'migrate-db'
+MIGRATIONS_FILE = "migrations.sql"
+
+# ballot IDs that were handed out more than once (possible before ballot IDs
+# were allocated under a lock), which stop the unique ballot ID index from
+# being built; also given in the README
+DUPLICATE_BALLOTS_QUERY = """SELECT ballot_id, COUNT(*) AS copies FROM ballots
+GROUP BY ballot_id HAVING COUNT(*) > 1;"""
+
+# most duplicate ballot IDs listed when migrate-db refuses to run
+MAX_DUPLICATES_SHOWN = 10
+
+# how long an unconfirmed election is kept for before it is cleared out
+PENDING_ELECTION_HOURS = 24
+
+# settings applied to every new connection: write-ahead logging lets the
+# bulletin board be read while votes are being written and, with
+# synchronous=NORMAL, means commits no longer fsync every time. Note we do not
+# turn on foreign_keys since receipts references the non-unique
+# ballots.ballot_id, which SQLite rejects as a foreign key mismatch.
+CONNECTION_PRAGMAS = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+PRAGMA temp_store = MEMORY;
+PRAGMA mmap_size = 268435456;
+PRAGMA cache_size = -65536;
+"""
+
 def getDBConnection() -> Optional[sqlite3.Connection]:
     """
-    Creates a Connection object that is reused via the special 'g' variable. If
-    for whatever reason we are unsuccessful then we print the error message and
-    return None.
+    Returns this thread's Connection to the database, opening it the first
+    time, which is reused via the special 'g' variable. If for whatever reason
+    we are unsuccessful then we print the error message and return None.
     """
     if 'db' not in g:
         try:
-            g.db = sqlite3.connect(current_app.config["DATABASE"])
-            
-            # Lets us access row columns by name
-            g.db.row_factory = sqlite3.Row
+            db_path = current_app.config["DATABASE"]
+            if not hasattr(local_connections, 'by_path'):
+                local_connections.by_path = {}
+            con = local_connections.by_path.get(db_path)
+            if con is None:
+                con = sqlite3.connect(db_path,
+                                      cached_statements=CACHED_STATEMENTS)
+                con.executescript(CONNECTION_PRAGMAS)
+                
+                # Lets us access row columns by name
+                con.row_factory = sqlite3.Row
+                local_connections.by_path[db_path] = con
+            g.db = con
         except Exception as e:
             print(f"Could not connect to database: {e}")
             return None
     return g.db
 
+def clearElectionCaches() -> None:
+    """Empties the in-process caches of election data."""
+    elections.clear()
+    election_times.clear()
+    election_questions.clear()
+    election_contacts.clear()
+    question_counts.clear()
+    closed_ballots.clear()
+    closed_tallies.clear()
+
 def closeDB(e=None) -> None:
-    """Closes the database gracefully when Flask finishes."""
+    """
+    Rolls back anything left uncommitted when Flask finishes with the request,
+    keeping the connection open for this thread's next request.
+    """
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        db.rollback()
 
 @click.command('init-db')
 @with_appcontext
@@ -59,14 +153,13 @@ def initDB() -> Optional[bool]:
     try:
         with current_app.open_resource("schema.sql") as f:
             con.executescript(f.read().decode('utf8'))
-            con.commit()
-            click.echo("Database initialised successfully.")
-            return True
+        runMigrations(con)
+        clearElectionCaches()
+        click.echo("Database initialised successfully.")
+        return True
     except Exception as e:
         click.echo(f"Could not initialise database: {e}")
         return None
-    finally:
-        con.close()
 
 @click.command('init-keys')
 @with_appcontext
@@ -86,6 +179,7 @@ def initKeys() -> Optional[bool]:
                     (sKeyToBytestr(private), sKeyToBytestr(public))
                     )
         con.commit()
+        private_keys.pop(current_app.config["DATABASE"], None)
         click.echo("New key pair successfully generated!")
         return True
     except Exception as e:
@@ -94,6 +188,41 @@ def initKeys() -> Optional[bool]:
     finally:
         cur.close()
 
+def runMigrations(con: sqlite3.Connection) -> None:
+    """
+    Runs the (idempotent) migrations file on the database, raising an exception
+    if any of it fails. Nothing is changed if the database holds duplicate
+    ballot IDs, since those must be resolved by hand before the unique ballot
+    ID index can be built.
+    """
+    duplicates = con.execute(DUPLICATE_BALLOTS_QUERY).fetchall()
+    if duplicates:
+        shown = ", ".join(str(row[0]) for row in duplicates[:MAX_DUPLICATES_SHOWN])
+        raise Exception(f"{len(duplicates)} ballot IDs are used by more than one ballot ({shown}), so ballot IDs cannot be made unique. Nothing was changed. List them with:\n{DUPLICATE_BALLOTS_QUERY}\nthen remove or renumber the duplicate ballots (and their receipts) and run migrate-db again.")
+    with current_app.open_resource(MIGRATIONS_FILE) as f:
+        con.executescript(f.read().decode('utf8'))
+    con.commit()
+
+@click.command('migrate-db')
+@with_appcontext
+def migrateDB() -> Optional[bool]:
+    """
+    Brings a database made with an older version of DRE-ipy up to date with
+    the 'migrate-db' command, keeping all of its data. Run this once after
+    upgrading, before starting the app.
+    """
+    con = getDBConnection()
+    if con is None:
+        return None
+    try:
+        runMigrations(con)
+        clearElectionCaches()
+        click.echo("Database migrated successfully.")
+        return True
+    except Exception as e:
+        # fail with a non-zero exit status so that upgrade scripts stop here
+        raise click.ClickException(f"Could not migrate database: {e}")
+
 def initApp(main: Flask) -> None:
     """
     Add the database Flask commands, as well as the method to close the
@@ -102,6 +231,7 @@ def initApp(main: Flask) -> None:
     main.teardown_appcontext(closeDB)
     main.cli.add_command(initDB)
     main.cli.add_command(initKeys)
+    main.cli.add_command(migrateDB)
 
 def insertElection(election: Election, voters: List[Voter]) -> Optional[bool]:
     """
@@ -134,19 +264,111 @@ def insertElection(election: Election, voters: List[Voter]) -> Optional[bool]:
                             (question_id, index_num, text, tally_total, sum_total) 
                             VALUES (?, ?, ?, 0, 0);""", question.sql_choices)
 
-        # insert voters
-        for voter in voters:
-            cur.execute("""INSERT INTO voters
-                        (voter_id, election_id, pass_hash, full_name, dob,
-                        postcode, uname, finished_voting, current_question)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, 0, 1);""",
-                        (voter.voter_id, election.election_id, voter.hash,
-                         voter.name, voter.dob, voter.postcode, voter.uname)
-                        )
+        # insert voters, packing VOTER_INSERT_BATCH rows into each statement
+        # and inserting any left over one row at a time
+        voter_rows = [(voter.voter_id, election.election_id, voter.hash,
+                       voter.name, voter.dob, voter.postcode, voter.uname)
+                      for voter in voters]
+        num_packed = len(voter_rows) - len(voter_rows) % VOTER_INSERT_BATCH
+        packed_sql = f"INSERT INTO {VOTER_COLUMNS} VALUES " + \
+                     ", ".join([VOTER_VALUES] * VOTER_INSERT_BATCH) + ";"
+        for i in range(0, num_packed, VOTER_INSERT_BATCH):
+            cur.execute(packed_sql, [value for row in
+                                     voter_rows[i:i + VOTER_INSERT_BATCH]
+                                     for value in row])
+        cur.executemany(f"INSERT INTO {VOTER_COLUMNS} VALUES {VOTER_VALUES};",
+                        voter_rows[num_packed:])
         con.commit()
         return True
     except Exception as e:
         print(f"Could not insert election: {e}")
+        con.rollback()
+        return None
+    finally:
+        cur.close()
+
+def insertPendingElection(pending_id: str, election: Election,
+                          voters: List[Voter]) -> Optional[bool]:
+    """
+    Stores a new election and its voters until its creator confirms it, rather
+    than sending them back and forth in the session cookie. Also clears out
+    any pending elections that were never confirmed.
+    """
+    con = getDBConnection()
+    if con is None:
+        return None
+    try:
+        cur = con.cursor()
+        cur.execute("""DELETE FROM pending_elections
+                        WHERE created < datetime('now', ?);""",
+                    (f"-{PENDING_ELECTION_HOURS} hours",)
+                    )
+        cur.execute("""INSERT INTO pending_elections (pending_id, election,
+                    voters, created)
+                    VALUES (?, ?, ?, datetime('now'));""",
+                    (pending_id, orjson.dumps(election.toDict()),
+                     orjson.dumps([voter.toDict() for voter in voters]))
+                    )
+        con.commit()
+        return True
+    except Exception as e:
+        print(e)
+        return None
+    finally:
+        cur.close()
+
+def getPendingElection(pending_id: str) -> Optional[Election]:
+    """Returns a pending election without decoding its voters."""
+    con = getDBConnection()
+    if con is None:
+        return None
+    try:
+        cur = con.cursor()
+        row = cur.execute("""SELECT election FROM pending_elections
+                            WHERE pending_id = ?;""", (pending_id,)
+                          ).fetchone()
+        if row is None:
+            return None
+        return Election.fromDict(orjson.loads(row['election']))
+    except Exception as e:
+        print(e)
+        return None
+    finally:
+        cur.close()
+
+def getPendingVoters(pending_id: str) -> Optional[List[Voter]]:
+    """Returns the voters of a pending election."""
+    con = getDBConnection()
+    if con is None:
+        return None
+    try:
+        cur = con.cursor()
+        row = cur.execute("""SELECT voters FROM pending_elections
+                            WHERE pending_id = ?;""", (pending_id,)
+                          ).fetchone()
+        if row is None:
+            return None
+        return [Voter.fromDict(voter) for voter in orjson.loads(row['voters'])]
+    except Exception as e:
+        print(e)
+        return None
+    finally:
+        cur.close()
+
+def deletePendingElection(pending_id: str) -> Optional[bool]:
+    """Removes a pending election once it has been confirmed."""
+    con = getDBConnection()
+    if con is None:
+        return None
+    try:
+        cur = con.cursor()
+        cur.execute("""DELETE FROM pending_elections
+                        WHERE pending_id = ?;""", (pending_id,)
+                    )
+        con.commit()
+        return True
+    except Exception as e:
+        print(e)
         return None
     finally:
         cur.close()
@@ -154,8 +376,11 @@ def insertElection(election: Election, voters: List[Voter]) -> Optional[bool]:
 def getElectionFromDb(election_id: str) -> Optional[Election]:
     """
     Tries to find the Election in the database from an ID and return it. If not
-    found then returns None.
+    found then returns None. Elections are cached once they have been found.
     """
+    key = (current_app.config["DATABASE"], election_id)
+    if key in elections:
+        return elections[key]
     con = getDBConnection()
     if con is None:
         return None
@@ -180,24 +405,31 @@ def getElectionFromDb(election_id: str) -> Optional[Election]:
             print("The end time could not be parsed into a datetime object.")
             raise Exception
         
-        # fetch questions
-        rows = cur.execute("""SELECT question_id
-                            FROM questions
-                            WHERE election_id = ?
-                            ORDER BY question_num ASC;""", (election_id,)
+        # fetch questions and their choices in one query
+        rows = cur.execute("""SELECT q.question_id, q.text AS query,
+                            q.num_answers, q.gen_2, c.text
+                            FROM questions AS q
+                            INNER JOIN choices AS c
+                                ON q.question_id = c.question_id
+                            WHERE q.election_id = ?
+                            ORDER BY q.question_num ASC, c.index_num ASC;""",
+                           (election_id,)
                            ).fetchall()
-        if rows is None:
+        if not rows:
             flash("No questions found for that election ID. Double check that you have typed it in correctly and try again.", "error")
             raise Exception
-        election_questions = []
-        for row in rows:
-            question = getQuestionById(row['question_id'])
-            if question is None:
-                print("Could not create question object.")
-                return None
-            election_questions.append(question)
-        return Election(election_id, title, election_questions,
-                                start_time, end_time, contact)
+        questions = []
+        for question_id, choice_rows in groupby(rows, key=itemgetter('question_id')):
+            choice_rows = list(choice_rows)
+            first = choice_rows[0]
+            questions.append(Question(question_id, election_id, first['query'],
+                                      first['num_answers'],
+                                      [row['text'] for row in choice_rows],
+                                      bytestrToPoint(first['gen_2'])
+                                      ))
+        elections[key] = Election(election_id, title, questions,
+                                  start_time, end_time, contact)
+        return elections[key]
     except Exception as e:
         print(e)
         return None
@@ -207,9 +439,12 @@ def getElectionFromDb(election_id: str) -> Optional[Election]:
 def getQuestionByNum(election_id: str, question_num: int) \
     -> Optional[Question]:
     """
-    Given a question's ID, returns a constructed Question object from the
-    database if possible; otherwise return None.
+    Given an election ID and question number, returns a constructed Question
+    object from the database (or the cache) if possible; otherwise return None.
     """
+    key = (current_app.config["DATABASE"], election_id, question_num)
+    if key in election_questions:
+        return election_questions[key]
     con = getDBConnection()
     if con is None:
         return None
@@ -229,48 +464,18 @@ def getQuestionByNum(election_id: str, question_num: int) \
                            ).fetchall()
         if not rows:
             return None
-        return Question(question_id, election_id, query, num_answers,
-                        [choice['text'] for choice in rows],
-                        bytestrToPoint(g2)
-                        )
+        election_questions[key] = Question(question_id, election_id, query,
+                                           num_answers,
+                                           [choice['text'] for choice in rows],
+                                           bytestrToPoint(g2)
+                                           )
+        return election_questions[key]
     except Exception as e:
         print(e)
         return None
     finally:
         cur.close()
 
-def getQuestionById(question_id: str) -> Optional[Question]:
-    """
-    Given a question's ID, returns a constructed Question object from the
-    database if possible; otherwise return None.
-    """
-    con = getDBConnection()
-    if con is None:
-        return None
-    try:
-        cur = con.cursor()
-        row = cur.execute("""SELECT election_id, text, num_answers, gen_2
-                            FROM questions WHERE (question_id = ?)
-                            LIMIT 1;""", (question_id,)
-                          ).fetchone()
-        if not row:
-            return None
-        election_id, query, num_answers, g2 = row
-        rows = cur.execute("""SELECT text FROM choices WHERE question_id = ?
-                            ORDER BY index_num ASC;""", (question_id,)
-                           ).fetchall()
-        if not rows:
-            return None
-        return Question(question_id, election_id, query, num_answers,
-                        [choice['text'] for choice in rows],
-                        bytestrToPoint(g2)
-                        )
-    except Exception as e:
-        print(e)
-        return None
-    finally:
-        cur.close()
-        
 def isElectionInDb(election_id: str) -> bool:
     """
     Given an election ID, check whether an election exists with that ID in the
@@ -290,11 +495,14 @@ def isElectionInDb(election_id: str) -> bool:
     finally:
         cur.close()
 
-def getElectionStatus(election_id: str) -> Optional[Status]:
+def getElectionTimes(election_id: str) -> Optional[Tuple[datetime, datetime]]:
     """
-    Given an election ID, returns its corresponding election Status if it exists,
-    otherwise return None.
+    Given an election ID, returns its start and end times if it exists,
+    otherwise return None. The times are parsed once and then cached.
     """
+    key = (current_app.config["DATABASE"], election_id)
+    if key in election_times:
+        return election_times[key]
     con = getDBConnection()
     if con is None:
         return None
@@ -306,17 +514,30 @@ def getElectionStatus(election_id: str) -> Optional[Status]:
         if row is None:
             return None
         start_time, end_time = row
-        start_time = parseTime(start_time)
-        end_time = parseTime(end_time)
-        return checkStatus(start_time, end_time)
+        election_times[key] = (parseTime(start_time), parseTime(end_time))
+        return election_times[key]
     except Exception as e:
         print(e)
         return None
     finally:
         cur.close()
 
+def getElectionStatus(election_id: str) -> Optional[Status]:
+    """
+    Given an election ID, returns its corresponding election Status if it exists,
+    otherwise return None. Only the election's times are cached, since its
+    status changes as time passes.
+    """
+    times = getElectionTimes(election_id)
+    if times is None:
+        return None
+    return checkStatus(*times)
+
 def getElectionContact(election_id: str) -> Optional[str]:
-    """Given an election ID, returns the contact for it."""
+    """Given an election ID, returns the (cached) contact for it."""
+    key = (current_app.config["DATABASE"], election_id)
+    if key in election_contacts:
+        return election_contacts[key]
     con = getDBConnection()
     if con is None:
         return None
@@ -327,7 +548,8 @@ def getElectionContact(election_id: str) -> Optional[str]:
                           ).fetchone()
         if row is None:
             return None
-        return row['contact']
+        election_contacts[key] = row['contact']
+        return election_contacts[key]
     except Exception as e:
         print(e)
         return None
@@ -391,29 +613,14 @@ def getVoterById(voter_id: str) -> Optional[Voter]:
     finally:
         cur.close()
 
-def getNewBallotID(question_id: str) -> Optional[int]:
-    """Returns a new ballot ID for the given question."""
-    con = getDBConnection()
-    if con is None:
-        return None
-    try:
-        cur = con.cursor()
-        row = cur.execute("""SELECT MAX(ballot_id) as max_id FROM ballots
-                            LIMIT 1;""").fetchone()
-        if not row:
-            return None
-        # base case for the first ballot
-        if row['max_id'] is None:
-            return 1
-        return int(row['max_id']) + 1
-    except Exception as e:
-        print(e)
-        return None
-    finally:
-        cur.close()
-
 def getPrivateKey() -> Optional[SigningKey]:
-    """Returns the private key for the current database."""
+    """
+    Returns the private key for the current database, only reading it from the
+    database the first time.
+    """
+    db_path = current_app.config["DATABASE"]
+    if db_path in private_keys:
+        return private_keys[db_path]
     con = getDBConnection()
     if con is None:
         return None
@@ -422,7 +629,8 @@ def getPrivateKey() -> Optional[SigningKey]:
         row = cur.execute("SELECT private_k FROM keys LIMIT 1;").fetchone()
         if row is None:
             return None
-        return bytestrToSKey(row['private_k'])
+        private_keys[db_path] = bytestrToSKey(row['private_k'])
+        return private_keys[db_path]
     except Exception as e:
         print(e)
         return None
@@ -457,14 +665,23 @@ def insertReceipt(ballot_id: int, r: mpz, R: Point, Z: Point, r_1: mpz,
         cur.close()
 
 
-def insertNewBallot(ballot_id: str, question_id: str, election_id: str) \
-                 -> Optional[bool]:
-    """Inserts a new record for a ballot for a given question and election."""
+def insertNewBallot(question_id: str, election_id: str) -> Optional[int]:
+    """
+    Inserts a new record for a ballot for a given question and election,
+    returning the new ballot's ID.
+    """
     con = getDBConnection()
     if con is None:
         return None
     try:
         cur = con.cursor()
+        # take the write lock before reading the current largest ID so that no
+        # other worker process can hand out the same ID in between
+        cur.execute("BEGIN IMMEDIATE;")
+        row = cur.execute("""SELECT MAX(ballot_id) AS max_id FROM ballots
+                            LIMIT 1;""").fetchone()
+        # base case for the first ballot
+        ballot_id = 1 if row['max_id'] is None else int(row['max_id']) + 1
         cur.execute("""INSERT INTO ballots (ballot_id, election_id, question_id,
                     was_audited, num_r, num_c, hash_1, sign_1, hash_2, sign_2,
                     json_1, json_2)
@@ -473,9 +690,10 @@ def insertNewBallot(ballot_id: str, question_id: str, election_id: str) \
                     (ballot_id, election_id, question_id)
                     )
         con.commit()
-        return True
+        return ballot_id
     except Exception as e:
         print(e)
+        con.rollback()
         return None
     finally:
         cur.close()
@@ -500,12 +718,12 @@ def addNumProofs(ballot_id: str, proof_c: mpz, proof_r: mpz) -> Optional[bool]:
     finally:
         cur.close()
 
-def updateVoteReceipt(signature: str, data_hash: str, ballot_id: int, json_str: str,
+def updateVoteReceipt(signature: str, data_hash: str, ballot_id: int, json_data: bytes,
                       first_stage: bool) \
     -> Optional[bool]:
     """
-    Updates a ballot with its signature and hash for the first/second stage
-    in the database.
+    Updates a ballot with its signature, hash and receipt JSON (as UTF-8
+    bytes) for the first/second stage in the database.
     """
     con = getDBConnection()
     if con is None:
@@ -517,13 +735,13 @@ def updateVoteReceipt(signature: str, data_hash: str, ballot_id: int, json_str:
             cur.execute("""UPDATE ballots
                             SET sign_1 = ?, hash_1 = ?, json_1 = ?
                             WHERE ballot_id = ?;""", (signature, data_hash,
-                                                      json_str, ballot_id)
+                                                      json_data, ballot_id)
                         )
         else:
             cur.execute("""UPDATE ballots
                             SET sign_2 = ?, hash_2 = ?, json_2 = ?
                             WHERE ballot_id = ?;""", (signature, data_hash,
-                                                      json_str, ballot_id)
+                                                      json_data, ballot_id)
                         )
         con.commit()
         return True
@@ -602,33 +820,27 @@ def updateAuditBallot(ballot_id: int, audited: bool) -> Optional[bool]:
     finally:
         cur.close()
 
-def deleteSecrets(ballot_id: int) -> Optional[bool]:
-    """Deletes the vote and random secret from a confirmed ballot."""
+def finalizeVote(ballot_id: int, voter_id: str, next_question: int,
+                 finished: bool, signature: str, data_hash: str,
+                 json_data: bytes) -> Optional[bool]:
+    """
+    Does all of the database work for confirming a ballot in one transaction:
+    marks it as not audited, adds its votes to the tallies, deletes its
+    secrets, stores its second-stage receipt and moves the voter on to their
+    next question (marking them as finished if that was their last one).
+    """
     con = getDBConnection()
     if con is None:
         return None
     try:
         cur = con.cursor()
-        cur.execute("""UPDATE receipts SET random_secret = NULL,
-                        voted = NULL WHERE ballot_id = ?;""" , (ballot_id,)
+        cur.execute("""UPDATE ballots
+                        SET was_audited = 0, sign_2 = ?, hash_2 = ?, json_2 = ?
+                        WHERE ballot_id = ?;""", (signature, data_hash,
+                                                  json_data, ballot_id)
                     )
-        con.commit()
-        return True
-    except Exception as e:
-        print(e)
-        return None
-    finally:
-        cur.close()
-
-def incrementTallies(ballot_id: str) -> Optional[bool]:
-    """Increases the tallies for the relevant choices for a given ballot."""
-    con = getDBConnection()
-    if con is None:
-        return None
-    try:
-        cur = con.cursor()
         rows = cur.execute("""SELECT b.question_id, r.choice_index, r.random_secret,
-                            r.voted, c.tally_total, c.sum_total
+                            c.tally_total, c.sum_total
                             FROM ((ballots AS b
                             INNER JOIN receipts AS r
                                 ON b.ballot_id = r.ballot_id)
@@ -636,33 +848,40 @@ def incrementTallies(ballot_id: str) -> Optional[bool]:
                                 ON r.choice_index = c.index_num
                                 AND b.question_id = c.question_id)
                             WHERE b.ballot_id = ?
-                            AND was_audited IS NOT NULL
-                            AND was_audited = 0;""", (ballot_id,)
+                            AND r.voted = 1;""", (ballot_id,)
                            ).fetchall()
-        if rows is None:
-            return None
-        for q_id, index, secret, voted, current_tally, current_sum in rows:
-            # only increment for choices the user actually voted for
-            if bool(voted):
-                new_tally = int(current_tally) + 1
-                new_sum = mpz(current_sum) + mpz(secret)
-                
-                cur.execute("""UPDATE choices
-                            SET tally_total = ?, sum_total = ?
-                            WHERE question_id = ?
-                            AND index_num = ?;""", (new_tally, str(new_sum), q_id,
-                                                    index)
-                            )
+        # only increment for choices the user actually voted for
+        cur.executemany("""UPDATE choices
+                        SET tally_total = ?, sum_total = ?
+                        WHERE question_id = ?
+                        AND index_num = ?;""",
+                        [(int(current_tally) + 1,
+                          str(mpz(current_sum) + mpz(secret)), q_id, index)
+                         for q_id, index, secret, current_tally, current_sum
+                         in rows]
+                        )
+        cur.execute("""UPDATE receipts SET random_secret = NULL,
+                        voted = NULL WHERE ballot_id = ?;""" , (ballot_id,)
+                    )
+        cur.execute("""UPDATE voters
+                        SET current_question = ?, finished_voting = ?
+                        WHERE voter_id = ?;""", (next_question, int(finished),
+                                                 voter_id)
+                    )
         con.commit()
         return True
     except Exception as e:
         print(e)
+        con.rollback()
         return None
     finally:
         cur.close()
 
 def totalQuestions(election_id: str) -> Optional[int]:
-    """Returns the total number of questions in a given election."""
+    """Returns the (cached) total number of questions in a given election."""
+    key = (current_app.config["DATABASE"], election_id)
+    if key in question_counts:
+        return question_counts[key]
     con = getDBConnection()
     if con is None:
         return None
@@ -673,120 +892,102 @@ def totalQuestions(election_id: str) -> Optional[int]:
                           ).fetchone()
         if row is None:
             return None
-        return int(row['num_qs'])
+        question_counts[key] = int(row['num_qs'])
+        return question_counts[key]
     except Exception as e:
         print(e)
         return None
     finally:
         cur.close()
 
-def nextQuestion(voter_id: str, next_question: int) -> Optional[bool]:
+def getElectionTallies(election: Election) -> Optional[Dict[str, List[Tuple]]]:
     """
-    Given a voter's ID, increments their question in the database and returns
-    it.
+    Given an election, returns the text, tally and sum of every choice, grouped
+    by question ID and in choice order, using a single query. The tallies of
+    CLOSED elections are final so are cached.
     """
+    key = (current_app.config["DATABASE"], election.election_id)
+    if key in closed_tallies:
+        return closed_tallies[key]
     con = getDBConnection()
     if con is None:
         return None
     try:
         cur = con.cursor()
-        cur.execute("""UPDATE voters SET current_question = ?
-                        WHERE voter_id = ?;""", (next_question, voter_id)
-                    )
-        con.commit()
-        return True
-    except Exception as e:
-        print(e)
-        return None
-    finally:
-        cur.close()
-
-def completeVoting(voter_id: str) -> Optional[bool]:
-    """Given a voter's ID, marks them as having completed their election."""
-    con = getDBConnection()
-    if con is None:
-        return None
-    try:
-        cur = con.cursor()
-        cur.execute("""UPDATE voters SET finished_voting = 1
-                        WHERE voter_id = ?;""", (voter_id,)
-                    )
-        con.commit()
-        return True
-    except Exception as e:
-        print(e)
-        return None
-    finally:
-        cur.close()
-
-def getQuestionTallies(question_id: str) -> Optional[List[Tuple]]:
-    """Given a question, returns the tallies and sums for all its choices."""
-    con = getDBConnection()
-    if con is None:
-        return None
-    try:
-        cur = con.cursor()
-        rows = cur.execute("""SELECT text, tally_total, sum_total
-                            FROM choices
-                            WHERE question_id = ?
-                            ORDER BY index_num ASC;""", (question_id,)
+        rows = cur.execute("""SELECT c.question_id, c.text, c.tally_total,
+                            c.sum_total
+                            FROM questions AS q INNER JOIN choices AS c
+                            ON q.question_id = c.question_id
+                            WHERE q.election_id = ?
+                            ORDER BY c.question_id, c.index_num ASC;""",
+                           (election.election_id,)
                            ).fetchall()
         if rows is None:
             return None
-        return rows
+        tallies = {question.question_id: [] for question in election.questions}
+        for q_id, choice, tally, sum in rows:
+            tallies[q_id].append((choice, tally, sum))
+        if election.status == Status.CLOSED:
+            closed_tallies[key] = tallies
+        return tallies
     except Exception as e:
         print(e)
         return None
     finally:
         cur.close()
 
-def getBallots(election: Election) -> Optional[dict]:
+def getBallots(election: Election) -> Optional[Dict[str, List[dict]]]:
     """
-    Returns a dictionary containing truncated ballot data for the bulletin
-    board.
+    Returns a dictionary of question ID to the truncated data of each of that
+    question's ballots for the bulletin board. The ballots of CLOSED elections
+    are final so are cached.
     """
+    key = (current_app.config["DATABASE"], election.election_id)
+    if key in closed_ballots:
+        return closed_ballots[key]
     con = getDBConnection()
     if con is None:
         return None
     try:
         cur = con.cursor()
-        rows = cur.execute("""SELECT ballot_id, question_id, was_audited, hash_1
-                            FROM ballots WHERE was_audited IS NOT NULL
-                            AND election_id = ?
-                            ORDER BY ballot_id;""", (election.election_id,)
+        # fetch every ballot along with the revealed choices of the audited
+        # ones in a single query; confirmed ballots get one row with no choice
+        rows = cur.execute("""SELECT b.ballot_id, b.question_id, b.was_audited,
+                            b.hash_1, c.text
+                            FROM ((ballots AS b
+                            LEFT JOIN receipts AS r
+                                ON b.was_audited = 1
+                                AND r.ballot_id = b.ballot_id
+                                AND r.voted = 1)
+                            LEFT JOIN choices AS c
+                                ON c.question_id = b.question_id
+                                AND c.index_num = r.choice_index)
+                            WHERE b.was_audited IS NOT NULL
+                            AND b.election_id = ?
+                            ORDER BY b.ballot_id, c.index_num ASC;""",
+                           (election.election_id,)
                            ).fetchall()
         if rows is None:
             flash("Could not get ballots", "error")
             return None
-        ballots = []
-        for b_id, q_id, audited, hash_1 in rows:
-            ballot = {
+
+        # group the ballots by question so each question's tab on the
+        # bulletin board only goes through its own ballots
+        ballots = {question.question_id: [] for question in election.questions}
+        for b_id, ballot_rows in groupby(rows, key=itemgetter(0)):
+            ballot_rows = list(ballot_rows)
+            _, q_id, audited, hash_1, _ = ballot_rows[0]
+            # get choices in a pretty pretty print format
+            ballots[q_id].append({
                     "ballot_id": int(b_id),
                     "question_id": q_id,
                     "audited": bool(audited),
                     "pretty": Markup(prettyReceipt(truncHash(hash_1))),
-                    "choices": ""
-                    }
-
-            choices = cur.execute("""SELECT text
-                                    FROM ((ballots AS b
-                                    INNER JOIN receipts AS r
-                                            ON b.ballot_id = r.ballot_id)
-                                    INNER JOIN choices AS c
-                                        ON r.choice_index = c.index_num
-                                            AND b.question_id = c.question_id)
-                                    WHERE b.ballot_id = ?
-                                    AND (was_audited = 1 AND voted = 1)
-                                    ORDER BY c.index_num ASC;""", (int(b_id),)
-                                  ).fetchall()
-            if choices is None:
-                return None
-
-            # get choices in a pretty pretty print format
-            for choice in choices:
-                ballot['choices'] += f"{choice['text']};<br>"
-            ballot['choices'] = Markup(ballot['choices'][:-5])
-            ballots.append(ballot)
+                    "choices": Markup(";<br>").join(
+                        row[4] for row in ballot_rows if row[4] is not None)
+                    })
+        if election.status == Status.CLOSED:
+            closed_ballots[key] = ballots
         return ballots
     except Exception as e:
         print(e)
@@ -821,12 +1022,12 @@ def getJSONBallots(election: Election) -> Optional[dict]:
                     "stage_1": {
                         "hash": hash_1,
                         "sign": sign_1,
-                        "data": json.loads(hexToString(json_1))
+                        "data": loadReceiptJson(json_1)
                         },
                     "stage_2": {
                         "hash": hash_2,
                         "sign": sign_2,
-                        "data": json.loads(hexToString(json_2))
+                        "data": loadReceiptJson(json_2)
                         }
                     }
             ballots.append(ballot)
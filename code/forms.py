@@ -4,21 +4,37 @@ from wtforms import (StringField, SubmitField, SelectField,
                      SelectMultipleField, RadioField, widgets)
 from wtforms.validators import DataRequired, ValidationError
 from werkzeug.utils import secure_filename
-from flask import current_app, flash
+from werkzeug.datastructures import FileStorage
+from flask import flash
 
-from helpers import parseTime, parseElection, mergeTime, newFilename
+from helpers import parseTime, parseElection, mergeTime
 from Election import Election
 from Question import Question
 
+from collections import defaultdict
 from datetime import datetime
-from typing import Tuple, Optional
-from markupsafe import escape
-import re
-import os
+from typing import Tuple, List, Dict, Optional
 
 # maximum length of the uploaded CSV filename (in chars)
 MAX_FILENAME_LENGTH = 50
 
+# maximum number of questions in an election and choices in a question; each
+# question needs its own generator and each choice a cryptogram per ballot, so
+# these bound the work an election creation form can cause
+MAX_QUESTIONS = 50
+MAX_CHOICES = 50
+
+# prefixes of the dynamic form fields that make up the election questions, i.e.
+# query_X, choice_X_Y and maxanswers_X
+QUESTION_FIELDS = frozenset(('query', 'choice', 'maxanswers'))
+
+def isFieldNum(num_str: str) -> bool:
+    """
+    Checks that the numeric part of a form field ID (e.g. the '2' in 'query_2')
+    is a non-empty string made up of only the digits 0-9.
+    """
+    return num_str.isascii() and num_str.isdigit()
+
 class ElectionForm(FlaskForm):
     """Form that is used for election creation."""
     # for the election date/time
@@ -55,19 +71,16 @@ class ElectionForm(FlaskForm):
         if len(field.data) != 1:
             raise ValidationError("Please enter a delimiter that is 1 character long for your CSV file.")
 
-    def validateFile(form: FlaskForm) -> Optional[str]:
+    def validateFile(form: FlaskForm) -> Optional[FileStorage]:
         """
         Make sure a CSV file of an appropriate filename length has been uploaded
-        and save the file under a new, random file name.
+        and return it to be read straight from the upload.
         """
         new_file = form.file.data
         if len(secure_filename(new_file.filename)) > MAX_FILENAME_LENGTH:
             flash(f"Please limit your filename length to {MAX_FILENAME_LENGTH} characters.", "error")
             return None
-        filepath = os.path.join(current_app.config["UPLOAD_FOLDER"],
-                                newFilename())
-        new_file.save(filepath)
-        return filepath
+        return new_file
 
     def validateDates(form: FlaskForm) -> Optional[Tuple[datetime, datetime]]:
         """Parse start/end times while validating them."""
@@ -98,64 +111,83 @@ class ElectionForm(FlaskForm):
             return None
         return (start_time, end_time)
 
-    def validateQuestions(form_data: dict) -> Optional[dict]:
-        """Fetches and validates all question data from the form multidict."""
-        questions = {}
+    def validateQuestions(form_data: Dict[str, str]) -> Optional[List[dict]]:
+        """
+        Fetches and validates all question data from the form multidict,
+        returning a list of questions in the order they were numbered.
+        """
+        # every question starts with empty slots so that fields can be
+        # added in whatever order they appear in the form
+        questions = defaultdict(lambda: {'query': None, 'numanswers': None,
+                                         'choices': {}})
         try:
             for id, value in form_data.items():
-                id = str(id)
-                q_match = re.fullmatch('^query_([0-9]+)$', id, re.IGNORECASE)
-                c_match = re.fullmatch('^choice_([0-9]+)_([0-9]+)$', id, re.IGNORECASE)
-                m_match = re.fullmatch('^maxanswers_([0-9]+)$', id, re.IGNORECASE)
+                # split e.g. 'choice_1_2' into 'choice' and '1_2' so that all
+                # other fields (title, dates, etc.) are skipped with one lookup;
+                # only the prefix needs lowercasing since the rest is digits
+                prefix, _, nums = id.partition('_')
+                prefix = prefix.lower()
+                if prefix not in QUESTION_FIELDS:
+                    continue
                 # query_X data
-                if q_match:
-                    question_num = int(q_match.group(1))
-                    new_query = str(value)
-                    if question_num in questions:
-                        if 'query' in questions[question_num]:
-                            flash(f"Multiple query text entries found for question {question_num}", "error")
-                            return None
-                        else:
-                            questions[question_num]['query'] = new_query
-                    else:
-                        questions[question_num] = {'query': new_query}
+                if prefix == 'query':
+                    if not isFieldNum(nums):
+                        continue
+                    question = questions[int(nums)]
+                    if question['query'] is not None:
+                        flash(f"Multiple query text entries found for question {int(nums)}", "error")
+                        return None
+                    question['query'] = value
                 # choice_X_Y data
-                elif c_match:
-                    question_num = int(c_match.group(1))
-                    choice_num = int(c_match.group(2))
-                    new_choice = str(value)
-                    if question_num in questions:
-                        if 'choices' in questions[question_num]:
-                            if choice_num in questions[question_num]['choices']:
-                                flash(f"Multiple entries found for choice number {choice_num} in question {question_num}", "error")
-                                return None
-                            else:
-                                questions[question_num]['choices'][choice_num] = new_choice
-                        else:
-                            questions[question_num]['choices'] = {choice_num:new_choice}
-                    else:
-                        questions[question_num] = {f'choice_{choice_num}':new_choice}
+                elif prefix == 'choice':
+                    nums = nums.split('_')
+                    if len(nums) != 2 or not isFieldNum(nums[0]) \
+                       or not isFieldNum(nums[1]):
+                        continue
+                    question_num = int(nums[0])
+                    choice_num = int(nums[1])
+                    choices = questions[question_num]['choices']
+                    if choice_num in choices:
+                        flash(f"Multiple entries found for choice number {choice_num} in question {question_num}", "error")
+                        return None
+                    choices[choice_num] = value
+                    if len(choices) > MAX_CHOICES:
+                        flash(f"Please limit each question to {MAX_CHOICES} choices.", "error")
+                        return None
                 # maxanswers_X data
-                elif m_match:
-                    question_num = int(m_match.group(1))
+                else:
+                    if not isFieldNum(nums):
+                        continue
                     num_answers = int(value)
                     if num_answers < 1:
                         raise ValidationError("The number of choices for a question must be at least 1.")
-                    if question_num in questions:
-                        if 'numanswers' in questions[question_num]:
-                            flash("Multiple entries found for number of choices in question {question_num}.", "error")
-                            return None
-                        else:
-                            questions[question_num]['numanswers'] = num_answers
-                    else:
-                        questions[question_num] = {'numanswers': num_answers}
-            # after for loop, ensure that no questions ask N or more answers
-            # where N = number of answers
+                    question = questions[int(nums)]
+                    if question['numanswers'] is not None:
+                        flash(f"Multiple entries found for number of choices in question {int(nums)}.", "error")
+                        return None
+                    question['numanswers'] = num_answers
+                # stop as soon as there are too many questions, rather than
+                # parsing the rest of an oversized form
+                if len(questions) > MAX_QUESTIONS:
+                    flash(f"Please limit your election to {MAX_QUESTIONS} questions.", "error")
+                    return None
+            # after for loop, ensure that every question is complete and that
+            # no questions ask N or more answers where N = number of answers
             for question_num, question_dict in questions.items():
-                if question_dict['numanswers'] >= len(question_dict['choices'].items()):
+                if question_dict['query'] is None \
+                   or question_dict['numanswers'] is None:
+                    flash(f"Question {question_num} is missing its text or number of answers.", "error")
+                    return None
+                if question_dict['numanswers'] >= len(question_dict['choices']):
                     flash("The number of choices must be less than the number of answers", "error")
                     return None
-            return questions
+            # numbers in the form may have gaps, so only use them for ordering
+            # and return the questions and their choices as plain lists
+            return [{'query': question_dict['query'],
+                     'numanswers': question_dict['numanswers'],
+                     'choices': [choice for choice_num, choice
+                                 in sorted(question_dict['choices'].items())]}
+                    for question_num, question_dict in sorted(questions.items())]
         except ValueError:
             flash("Invalid type encountered when parsing the questions - please check that all values are of the correct type and try again.", "error")
             return None
@@ -1,28 +1,30 @@
 from flask import flash, current_app, url_for
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.routing import BaseConverter
 from gmpy2 import mpz, powmod
 from ecdsa import SigningKey, VerifyingKey, NIST256p
 from ecdsa.ellipticcurve import Point
-from markupsafe import escape
 import matplotlib.pyplot as plt
-import jsonpickle
 import gmpy2
 
 from Voter import Voter
 from Election import Election
 from Question import Question
 from crypto import (generateRandSecret, generateR, generateZ, generateZKProof,
-                    generatePair, hashString, generateNumProof, signData,
-                    verifyZKProof, g1)
+                    generatePair, hashString, generateNumProof, signData)
 
 from urllib.parse import urlparse, urljoin
-from uuid import uuid4
 from ast import literal_eval
-from base64 import b64decode, b64encode
+from base64 import b64decode
 from datetime import datetime
-from secrets import token_urlsafe, token_hex
-from typing import Union, Dict, Any, Tuple, List, Generic, Optional
+from hmac import compare_digest
+from secrets import token_hex, token_urlsafe
+from threading import Lock
+from typing import Union, Dict, Any, Tuple, List, Generic, Optional, IO
+import codecs
 import csv
 import json
+import orjson
 import os
 
 DOB_FORMAT = "%d-%m-%Y"
@@ -33,6 +35,9 @@ CSV_HEADERS = sorted(['fname', 'lname', 'postcode', 'uname', 'dob', 'pass'])
 # maximum size of our sample from the CSV
 SAMPLE_SIZE = 5
 
+# text encoding of uploaded voter CSV files
+CSV_ENCODING = "utf-8"
+
 # these are the max lengths for first and last names
 FNAME_MAX_LENGTH = 35
 LNAME_MAX_LENGTH = 35
@@ -41,19 +46,73 @@ POSTCODE_MAX_LENGTH = 8
 # how short to truncate a hash digest to
 HASH_LENGTH = 50
 
-# Code for dicts from: https://www.pythonpool.com/python-csv-dictreader/
-class InsensitiveDict(dict):
-    def __getitem__(self, key):
-        return dict.__getitem__(self, key.strip().lower())
-
-class InsensitiveDictReader(csv.DictReader):
-    @property
-    def fieldnames(self):
-        return [field.strip().lower() for field in
-                csv.DictReader.fieldnames.fget(self)]
-
-    def next(self):
-        return InsensitiveDict(csv.DictReader.next(self))
+# number of random bytes in an ID from makeID() (2 hex characters per byte)
+ID_BYTES = 3
+
+# number of random bytes fetched from the OS at a time for makeID()
+ID_POOL_SIZE = 4096
+
+class RandomPool():
+    """
+    Buffer of random bytes from os.urandom() that is handed out in small
+    chunks, so that making many IDs (e.g. one per voter in checkCsv) only needs
+    one call to the OS per pool_size bytes rather than one call per ID.
+    """
+    def __init__(self, pool_size: int):
+        self._pool_size = pool_size
+        self._buffer = b""
+        self._offset = 0
+        self._pid = None
+        self._lock = Lock()
+
+    def take(self, num_bytes: int) -> bytes:
+        """Returns the next num_bytes random bytes from the pool."""
+        with self._lock:
+            # refill when empty, and also after a fork so that worker
+            # processes never hand out the same bytes as their parent
+            if self._offset + num_bytes > len(self._buffer) \
+               or self._pid != os.getpid():
+                self._buffer = os.urandom(max(self._pool_size, num_bytes))
+                self._offset = 0
+                self._pid = os.getpid()
+            chunk = self._buffer[self._offset:self._offset + num_bytes]
+            self._offset += num_bytes
+            return chunk
+
+id_pool = RandomPool(ID_POOL_SIZE)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask JSON provider (also used to serialise the session cookie) that uses
+    orjson, falling back to the default provider for anything orjson cannot
+    encode, like integers over 64 bits, and for loading with hooks such as
+    the session's object_hook, which orjson does not support.
+    """
+    # nothing we serialise (mostly the session cookie) needs its keys sorted
+    sort_keys = False
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=self.default,
+                                option=option).decode()
+        except TypeError:
+            return super().dumps(obj, **kwargs)
+
+    def loads(self, s: Union[str, bytes], **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+class ElectionIdConverter(BaseConverter):
+    """
+    URL converter that only matches election IDs in the form made by makeID()
+    (ID_BYTES bytes as uppercase hex), so any other value is a 404 before
+    the view or database is reached.
+    """
+    regex = f"[0-9A-F]{{{ID_BYTES * 2}}}"
 
 def generateSession() -> str:
     """Returns a cryptographically secure session ID"""
@@ -63,45 +122,97 @@ def generateSession() -> str:
 def makeFolder(path: str, permissions: int) -> None:
     """Create a folder that may or may not already exist."""
     try:
-        os.makedirs(path, mode=permissions)
+        os.makedirs(path, mode=permissions, exist_ok=True)
     except OSError:
         pass
 
+def removeFile(path: str) -> None:
+    """Delete a file that may or may not still exist."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def loadSecretKey(path: str, num_bytes: int) -> str:
+    """
+    Returns the secret key saved at the given path, first generating and
+    saving one (readable only by its owner) if there isn't one yet.
+    """
+    # write to a temporary file and link it into place so that processes
+    # starting at the same time all end up with the same key
+    temp_path = f"{path}.{os.getpid()}"
+    fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as key_file:
+        key_file.write(token_hex(num_bytes))
+    try:
+        os.link(temp_path, path)
+    except FileExistsError:
+        pass
+    finally:
+        removeFile(temp_path)
+    with open(path) as key_file:
+        return key_file.read().strip()
+
 def makeID() -> str:
     """
     Generates a random, unique ID; note not long enough to be cryptographically
     secure!!
     """
-    from main import SECRET_BYTES
-    return token_hex(SECRET_BYTES)[:6].upper()
+    return id_pool.take(ID_BYTES).hex().upper()
 
 def parseTime(time_str: str) -> Optional[datetime]:
     """
     Returns a datetime object constructed from parsing the input string. If the
     string is not well-formed, returns None.
     """
+    # zero-padded times (how they are stored in the database) are exactly ISO
+    # 8601 so use the C parser for them; we check the shape first since
+    # fromisoformat() accepts more than TIME_FORMAT does (e.g. 'T' separators)
+    if len(time_str) == 19 and time_str[4] == time_str[7] == '-' \
+       and time_str[10] == ' ' and time_str[13] == time_str[16] == ':':
+        try:
+            return datetime.fromisoformat(time_str)
+        except ValueError:
+            return None
     try:
         return datetime.strptime(time_str, TIME_FORMAT)
     except ValueError:
         return None
 
-def parseElection(election_id: str, questions: Dict, start_time: datetime,
+def parseDob(dob_str: str) -> Optional[datetime]:
+    """
+    Returns a datetime object constructed from parsing a date of birth in
+    DOB_FORMAT. If the string is not well-formed, returns None.
+    """
+    # checkCsv() parses one of these per voter, so build the datetime directly
+    # for zero-padded dates rather than going through strptime()
+    digits = dob_str[:2] + dob_str[3:5] + dob_str[6:]
+    if len(dob_str) == 10 and dob_str[2] == dob_str[5] == '-' \
+       and digits.isascii() and digits.isdigit():
+        try:
+            return datetime(int(dob_str[6:]), int(dob_str[3:5]),
+                            int(dob_str[:2]))
+        except ValueError:
+            return None
+    try:
+        return datetime.strptime(dob_str, DOB_FORMAT)
+    except ValueError:
+        return None
+
+def parseElection(election_id: str, questions: List[Dict], start_time: datetime,
                   end_time: datetime, title: str, contact: str) -> Election:
     """
-    Given a dictionary of questions and choices, with the start/end times try
-    to create an Election object and return it; otherwise return None.
+    Given an ordered list of questions and their choices (as returned by
+    ElectionForm.validateQuestions), with the start/end times try to create an
+    Election object and return it; otherwise return None.
     """
     question_objs = []
-    # note that we sort all our dictionaries to ensure that we get the correct
-    # ordering of our lists when we iterate through them
-    for question_num, question_dict in sorted(questions.items()):
-        choices = [choice for choice_num, choice \
-                   in sorted(question_dict['choices'].items())]
+    for question_dict in questions:
         question_id = makeID()
         gen_1, gen_2 = generatePair(question_id)
         question_objs.append(Question(question_id, election_id, question_dict['query'],
-                                      question_dict['numanswers'], choices,
-                                      gen_2))
+                                      question_dict['numanswers'],
+                                      question_dict['choices'], gen_2))
     return Election(election_id, title, question_objs, start_time, end_time,
                     contact)
 
@@ -113,18 +224,10 @@ def mergeTime(year: str, month: str, day: str, hour: str) -> str:
     return f"{year}-{month}-{day} {hour}:00:00" 
 
 def clearSession(session: Dict) -> None:
-    """Given a Flask session, pop all its keys if any exist."""
-    for key in list(session.keys()):
-        session.pop(key, None)
+    """Given a Flask session, remove all of its keys."""
+    session.clear()
     
-def newFilename() -> str:
-    """
-    Generates a random, new filename for the voter CSV file for us to save it
-    as.
-    """
-    return f"{makeID()}.csv"
-
-def checkCsv(election_id: str, filepath: str, delimiter: str) \
+def checkCsv(election_id: str, csv_file: IO[bytes], delimiter: str) \
     -> Optional[List[Voter]]:
     """
     Returns all the Voter objects for the election after some basic checks on
@@ -134,51 +237,63 @@ def checkCsv(election_id: str, filepath: str, delimiter: str) \
     passing them to DRE-ipy.
     """
     voters = []
-    unames = {}
-    with open(filepath, 'r', newline='') as f:
-        reader = InsensitiveDictReader(f, delimiter=delimiter)
-        if sorted(reader.fieldnames) != CSV_HEADERS:
+    unames = set()
+    # decode the uploaded file line by line as it is read, rather than saving a
+    # copy of it. Werkzeug's upload is a SpooledTemporaryFile, which cannot be
+    # wrapped in an io.TextIOWrapper before Python 3.11
+    with csv_file as f:
+        # read rows as plain lists rather than a dict per row, picking fields
+        # out by their (case-insensitive) header's position
+        reader = csv.reader(codecs.iterdecode(f, CSV_ENCODING),
+                            delimiter=delimiter)
+        headers = [header.strip().lower() for header in next(reader, [])]
+        if sorted(headers) != CSV_HEADERS:
             flash("Mismatch in CSV file headers. Did you pass the correct delimiter? Did you spell one of your headers wrong?")
             return None
+        num_fields = len(headers)
+        fname_i, lname_i, postcode_i, uname_i, dob_i, pass_i = \
+            (headers.index(header) for header in
+             ('fname', 'lname', 'postcode', 'uname', 'dob', 'pass'))
         for row in reader:
-            # extra data gets put under the None key in the dict -- we don't
-            # want this!
-            if None in row:
-                flash("Found a row with more data than fields specified. Please ensure that each row has exactly 1 entry for each header.")
+            # skip blank lines
+            if not row:
+                continue
+            if len(row) != num_fields:
+                flash("Found a row with more or less data than fields specified. Please ensure that each row has exactly 1 entry for each header.")
                 return None
             # DoB checks
-            try:
-                dob = datetime.strptime(row['dob'], DOB_FORMAT)
-            except ValueError:
+            dob = parseDob(row[dob_i])
+            if dob is None:
                 flash("Found a row with a badly-formed date of birth. Please ensure that each date of birth is in the form DD-MM-YYYY.")
                 return None
             # username checks
-            uname = row['uname']
+            uname = row[uname_i]
             if uname in unames:
                 flash(f"Found a duplicate username: {uname}. Please ensure that each username is unique in the CSV file.")
                 return None
-            unames[uname] = True
+            unames.add(uname)
             # length checks on other fields - truncate long names rather than
             # reject outright for maximum accessibility
-            fname = row['fname'][:FNAME_MAX_LENGTH]
-            lname = row['lname'][:LNAME_MAX_LENGTH]
+            fname = row[fname_i][:FNAME_MAX_LENGTH]
+            lname = row[lname_i][:LNAME_MAX_LENGTH]
             name = f"{fname} {lname}".upper()
-            postcode = row['postcode'][:POSTCODE_MAX_LENGTH].upper()
-            hash = hashString(row['pass'])
-            if not row['fname'] or not row['lname'] or not row['postcode']:
+            postcode = row[postcode_i][:POSTCODE_MAX_LENGTH].upper()
+            if not fname or not lname or not postcode:
                 flash("Empty field found in CSV file. Please make sure that all fields are filled out with the appropriate data.")
                 return None
+            hash = hashString(row[pass_i])
             voters.append(Voter(makeID(), election_id, name, postcode,
                                 uname, dob, hash))
     return voters
 
-def stringToHex(string: str) -> str:
-    """Converts string to base-64 encoding after encoding as UTF-8."""
-    return b64encode(string.encode('utf-8'))
-
-def hexToString(hex_string: str) -> str:
-    """Decodes base-64 encoded string."""
-    return b64decode(hex_string).decode('utf-8')
+def loadReceiptJson(json_data: bytes) -> dict:
+    """
+    Returns a receipt stored with a ballot as its UTF-8 encoded JSON, also
+    accepting the base-64 encoded JSON stored by earlier versions.
+    """
+    if not json_data.startswith(b'{'):
+        json_data = b64decode(json_data)
+    return json.loads(json_data)
 
 def bytestrToPoint(bytestring: str) -> Point:
     """
@@ -224,9 +339,10 @@ def prettyReceipt(receipt: str) -> str:
 def validateHash(user_code: str, db_hash: str) -> bool:
     """
     Given a user's election code, checks that its hash matches with the stored
-    value when passed through hash function.
+    value when passed through hash function. The comparison takes the same
+    time however much of the hash matches.
     """
-    return hashString(user_code) == db_hash
+    return compare_digest(hashString(user_code), db_hash)
 
 def hexToMpz(hexstring: Union[str, int]) -> mpz:
     """Converts a hexstring or int to an mpz object."""
@@ -243,21 +359,19 @@ def truncHash(hash_str: str) -> str:
 
 def firstReceipt(question: Question, election_id: str, voter_id: str,
                  choices: List[str]) -> Optional[dict]:
-    from db import getNewBallotID, insertNewBallot, insertReceipt, addNumProofs
+    from db import insertNewBallot, insertReceipt, addNumProofs
 
-    # get a new ballot ID for this ballot
-    ballot_id = int(getNewBallotID(question.question_id))
+    # insert ballot into database, getting a new ballot ID for it
+    ballot_id = insertNewBallot(question.question_id, election_id)
+    if ballot_id is None:
+        flash("Could not add a ballot for your vote to the database!", "error")
+        return None
     num_choices = len(question.choices)
     R_list = []
     Z_list = []
     r_list = []
     choice_list = []
 
-    # insert ballot into database
-    if insertNewBallot(ballot_id, question.question_id, election_id) is None:
-        flash("Could not add a ballot for your vote to the database!", "error")
-        return None
-
     for choice in range(num_choices):
         # was this choice voted on?
         voted = choice in choices
@@ -288,9 +402,6 @@ def firstReceipt(question: Question, election_id: str, voter_id: str,
             "r_2": str(r_2)
             })
 
-        print(verifyZKProof(question.question_id, g1, question.gen_2, R, Z, c_1, c_2,
-                            r_1, r_2))
-
         # add receipts and secret to list for final proof
         R_list.append(R)
         Z_list.append(Z)
@@ -334,9 +445,23 @@ def auditBallot(ballot_id: int) -> Optional[dict]:
     updateAuditBallot(ballot_id, audited=True)
     return new_receipt
 
-def confirmBallot(ballot_id: dict, num_choices: int) -> Optional[dict]:
-    """Marks a ballot as 'confirmed' and marks its secrets as DELETED."""
-    from db import updateAuditBallot, getBallotData
+def signReceipt(receipt: dict) -> Tuple[str, str, bytes]:
+    """
+    Returns the SHA-512 hash of a receipt dumped as a JSON string, that hash
+    signed with the election's private key, and the JSON as UTF-8 bytes to
+    store with the ballot. The JSON is only encoded once for all three.
+    """
+    from db import getPrivateKey
+    json_bytes = json.dumps(receipt).encode('utf-8')
+    data_hash = hashString(json_bytes)
+    return data_hash, signData(data_hash, getPrivateKey()), json_bytes
+
+def confirmBallot(ballot_id: int) -> Optional[dict]:
+    """
+    Returns the 'confirmed' receipt for a ballot with its secrets marked as
+    DELETED. The ballot itself is updated by finalizeVote.
+    """
+    from db import getBallotData
     new_receipt = {
         "ballot_id": ballot_id,
         "state": "CONFIRMED",
@@ -352,8 +477,6 @@ def confirmBallot(ballot_id: dict, num_choices: int) -> Optional[dict]:
             'choice': choice,
             'r': "DELETED",
             'voted': "DELETED"})
-        
-    updateAuditBallot(ballot_id, audited=False)
     return new_receipt
 
 def electionTotals(election: Election) -> Optional[dict]:
@@ -361,16 +484,16 @@ def electionTotals(election: Election) -> Optional[dict]:
     Given an election object, returns a dictionary of the totals
     calculated for it.
     """
-    from db import getQuestionTallies
+    from db import getElectionTallies
+    tallies = getElectionTallies(election)
+    if tallies is None:
+        flash(f"Could not get tallies for election ID: {election.election_id}",
+              "error")
+        return None
     totals = {}
     for question in election.questions:
         totals[question.question_id] = []
-        results = getQuestionTallies(question.question_id)
-        if results is None:
-            flash(f"Could not get tallies for question ID: {question.question_id}",
-                  "error")
-            return None
-        for choice, tally, sum in results:
+        for choice, tally, sum in tallies[question.question_id]:
             totals[question.question_id].append({
                 "choice": choice,
                 "tally": tally,
@@ -452,7 +575,11 @@ def makeElectionJson(election: Election) -> Optional[bool]:
     json_dict['hash'] = hashString(json.dumps(json_dict['election_data']))
     json_dict['sign'] = signData(json_dict['hash'], private_key)
 
-    with open(filepath, 'w') as f:
+    # write to a temporary file first so a concurrent download never finds
+    # the file half-written
+    temp_path = f"{filepath}.{token_hex(8)}.tmp"
+    with open(temp_path, 'w') as f:
         f.write(json.dumps(json_dict))
+    os.replace(temp_path, filepath)
 
     return True
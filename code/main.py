@@ -2,50 +2,84 @@ from flask import (Flask, render_template, redirect, session, url_for, Markup,
                    request, g, abort, flash, make_response, send_from_directory)
 from flask_wtf.csrf import CSRFProtect
 from flask_login import LoginManager, login_user, current_user, login_required
+from flask_compress import Compress
+from jinja2 import FileSystemBytecodeCache
 
 from wtforms.validators import ValidationError
-from werkzeug.datastructures import CombinedMultiDict
-from markupsafe import escape
 
 from Voter import Voter
+from Election import Election
+from Status import Status, checkStatus
 from helpers import (parseTime, mergeTime, makeID, clearSession, firstReceipt,
-                     checkCsv, makeFolder, bytestrToVKey, sKeyToBytestr,
-                     auditBallot, prettyReceipt, parseElection, truncHash,
-                     confirmBallot, electionTotals, makeElectionJson,
-                     stringToHex, makeElectionGraph)
+                     generateSession, checkCsv, makeFolder,
+                     auditBallot, prettyReceipt,
+                     parseElection, truncHash, confirmBallot, electionTotals,
+                     makeElectionJson, signReceipt, makeElectionGraph,
+                     OrjsonProvider, ElectionIdConverter, loadSecretKey)
 from forms import (ElectionForm, SubmitForm, ViewElectionForm, LoginForm,
                    QuestionForm, AuditForm)
 from db import (initApp, insertElection, getElectionFromDb, getVoterFromDb,
-                isElectionInDb, getElectionStatus,
-                getQuestionByNum, getNewBallotID, getPrivateKey,
+                isElectionInDb, getElectionStatus, getElectionTimes,
+                getQuestionByNum, getPrivateKey,
                 updateVoteReceipt, deleteBallot, getElectionContact,
-                updateAuditBallot, incrementTallies, deleteSecrets,
-                getVoterById, nextQuestion, completeVoting, getBallots,
-                totalQuestions, getQuestionTallies)
-from crypto import signData, hashString, verifyData
+                updateAuditBallot, finalizeVote, getVoterById, getBallots,
+                totalQuestions, insertPendingElection, getPendingElection,
+                getPendingVoters, deletePendingElection)
+from crypto import verifyData
 
 from typing import Optional
 from datetime import datetime
+from functools import lru_cache
 
-from secrets import token_bytes, token_hex
 from socket import gethostname, gethostbyname
-import json
-import jsonpickle
 import os
 
 # file/directory names and paths
 DB_NAME = "dreipy.sqlite"
-UPLOAD_FOLDER = "uploads/"
 GRAPH_FOLDER = "static/graphs/"
 DOWNLOAD_FOLDER = "json/"
+TEMPLATE_CACHE_FOLDER = "jinja_cache/"
+SECRET_KEY_FILE = "secret.key"
+
+# permissions for the folders made at startup (owner rwx, group r-x)
+FOLDER_PERMISSIONS = 0o750
 
 # maximum size of the uploaded Voter CSV file (MiB)
 MAX_FILE_SIZE_LIMIT = 5
+FILE_TOO_LARGE_MESSAGE = f"You tried to upload a file that was too large. Please only upload files with size up to {MAX_FILE_SIZE_LIMIT}MiB."
 
 # number of bytes to use when generating secrets
 # https://docs.python.org/3/library/secrets.html#how-many-bytes-should-tokens-use
 SECRET_BYTES = 32
 
+# only responses of these types and at least this size (bytes) are compressed
+COMPRESS_MIMETYPES = ['text/html']
+COMPRESS_MIN_SIZE = 1024
+
+# environment variable holding the secret key used to sign sessions and CSRF
+# tokens; it must be the same for every worker process
+SECRET_KEY_VARIABLE = "DREIPY_SECRET"
+
+# seconds browsers may cache an election's JSON file for; it never changes
+# once made
+JSON_MAX_AGE = 24 * 60 * 60
+
+# error shown when confirmElection() has no pending election from create()
+NO_PENDING_ELECTION_MESSAGE = "Election incomplete, ensure that you correctly filled out the election details here."
+
+# pages of the voting process that share the checks in checkVoter()
+VOTING_ENDPOINTS = frozenset(('voting', 'auditOrConfirm', 'showBallot'))
+
+# session keys that must be present before a ballot can be audited/confirmed
+AUDIT_SESSION_KEYS = frozenset(('sign_1', 'hash_1', 'ballot_id'))
+
+# session keys that must be present before the final ballot can be shown
+BALLOT_SESSION_KEYS = frozenset(('sign_2', 'hash_2', 'hash_1', 'ballot_id', 'audited'))
+
+# every session key used while casting a ballot, cleared once it is finished
+VOTE_SESSION_KEYS = ('ballot_id', 'question_id', 'hash_1', 'sign_1', 'hash_2',
+                     'sign_2', 'audited', 'choices')
+
 # for launch
 #my_host = f"http://{gethostbyname(gethostname())}"
 
@@ -54,34 +88,51 @@ my_host = f"http://127.0.0.1:5000"
 
 ## FLASK APP SETUP
 main = Flask(__name__)
+main.json = OrjsonProvider(main)
+main.url_map.converters['election'] = ElectionIdConverter
 
 dbPath = os.path.join(main.instance_path, DB_NAME)
-uploadPath = os.path.join(main.instance_path, UPLOAD_FOLDER)
 downloadPath = os.path.join(main.instance_path, DOWNLOAD_FOLDER)
+secretKeyPath = os.path.join(main.instance_path, SECRET_KEY_FILE)
+templateCachePath = os.path.join(main.instance_path, TEMPLATE_CACHE_FOLDER)
 graphPath = os.path.join(os.path.dirname(__file__), GRAPH_FOLDER)
 
-# randomly generate a new secret key
-main.secret_key = token_bytes(SECRET_BYTES)
+# create all the relevant folders
+makeFolder(main.instance_path, permissions=FOLDER_PERMISSIONS)
+makeFolder(downloadPath, permissions=FOLDER_PERMISSIONS)
+makeFolder(graphPath, permissions=FOLDER_PERMISSIONS)
+makeFolder(templateCachePath, permissions=FOLDER_PERMISSIONS)
+
+# keep compiled templates on disk so each new worker process loads them rather
+# than compiling every template again (Jinja checks the source is unchanged)
+main.jinja_env.bytecode_cache = FileSystemBytecodeCache(templateCachePath)
+
+# use the secret key from the environment, or else the one kept in the
+# instance folder, so that sessions survive restarts and are shared by workers
+secret_key = os.environ.get(SECRET_KEY_VARIABLE)
+if not secret_key:
+    secret_key = loadSecretKey(secretKeyPath, SECRET_BYTES)
 main.config.from_mapping(
-    SECRET_KEY = token_hex(SECRET_BYTES),
+    SECRET_KEY = secret_key,
     DATABASE = dbPath,
-    UPLOAD_FOLDER = uploadPath,
     JSON_FOLDER = downloadPath,
     GRAPH_FOLDER = graphPath,
     MAX_CONTENT_LENGTH = MAX_FILE_SIZE_LIMIT * 1024 * 1024,
     SESSION_COOKIE_SECURE = False,   # we're not using HTTPS yet
     SESSION_COOKIE_HTTPONLY = True,  # cookies cannot be read with JS
-    SESSION_COOKIE_SAMESITE = 'Strict'  # don't send cookies with any external requests
+    SESSION_COOKIE_SAMESITE = 'Strict',  # don't send cookies with any external requests
+    COMPRESS_MIMETYPES = COMPRESS_MIMETYPES,
+    COMPRESS_MIN_SIZE = COMPRESS_MIN_SIZE,
+    COMPRESS_LEVEL = 5,
+    COMPRESS_REGISTER = False  # only compress the views marked below
 )
 
 # force the use of CSRF tokens in forms
 CSRFProtect(main)
 
-# create all the relevant folders
-makeFolder(main.instance_path, permissions=750)
-makeFolder(uploadPath, permissions=750)
-makeFolder(downloadPath, permissions=750)
-makeFolder(graphPath, permissions=750)
+# compress the large public bulletin board; pages with forms are left alone, as
+# compressing secrets (CSRF tokens) next to user input allows BREACH attacks
+compress = Compress(main)
 
 # start the app and add the login manager
 initApp(main)
@@ -102,12 +153,68 @@ def after_request(response):
     # CSP: only allow the user agent to load resources from 'self' apart
     # from scripts which can come from jQuery source AND our form.js file
     # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Content-Security-Policy
-    response.headers['Content-Security-Policy'] = f"default-src 'self'; \
-script-src https://ajax.googleapis.com/ajax/libs/jquery/3.5.1/jquery.min.js \
-{my_host}{url_for('static', filename='form.js')}"
+    response.headers['Content-Security-Policy'] = contentSecurityPolicy()
     
     return response
 
+@lru_cache(maxsize=1)
+def contentSecurityPolicy() -> str:
+    """
+    Returns the Content-Security-Policy header for every response, built on the
+    first request (it needs url_for) and reused after that.
+    """
+    return f"default-src 'self'; \
+script-src https://ajax.googleapis.com/ajax/libs/jquery/3.5.1/jquery.min.js \
+{my_host}{url_for('static', filename='form.js')}"
+
+@main.before_request
+def checkVoter():
+    """
+    Run before all requests to the voting pages to make sure that the logged in
+    voter is on the right question of an ongoing election that they belong to.
+    If not, returns a redirect which Flask sends instead of the requested page.
+    """
+    # anonymous users are left for login_required to turn away
+    if request.endpoint not in VOTING_ENDPOINTS \
+       or not current_user.is_authenticated:
+        return None
+    election_id = request.view_args['election_id']
+    question_num = request.view_args['question_num']
+
+    # the ballot page is also shown after the voter's final question has been
+    # confirmed, by which point they have voted and the election may have closed
+    showing_ballot = request.endpoint == "showBallot"
+
+    # make sure that this user is for the correct election!
+    if current_user.election_id != election_id:
+        flash("Wrong election. Please log into the correct election before trying to vote!", "error")
+        return redirect(url_for("voting", election_id=current_user.election_id,
+                                question_num=current_user.current))
+
+    # for users that have finished voting, send them to the results page
+    if current_user.voted and not showing_ballot:
+        flash("You've already voted! Look at the election bulletin board below", "info")
+        return redirect(url_for("results", election_id=election_id))
+
+    # make sure that the question number in the request matches the backend
+    if current_user.current != question_num:
+        flash("Redirected to the correct question number.", "info")
+        return redirect(url_for("voting", election_id=election_id,
+                                question_num=current_user.current))
+
+    # sanity check on the election status
+    status = getElectionStatus(election_id)
+    if status is None:
+        flash("Bad election ID passed, please try again!", "error")
+        return redirect(url_for("view"))
+    if status == Status.PENDING:
+        flash("That election has not started yet!", 'error')
+        return redirect(url_for("view"))
+    if status == Status.CLOSED and not showing_ballot:
+        flash("That election has closed! Check out its results below.", 'error')
+        return redirect(url_for("results", election_id=election_id))
+    return None
+
 @login_manager.user_loader
 def load_voter(voter_id: str) -> Optional[Voter]:
     """
@@ -130,7 +237,7 @@ def not_found(error):
     """
     Callback for attempting to access endpoints that do not exist (HTTP 404).
     """
-    return render_template("not_found.html")
+    return render_template("not_found.html"), 404
 
 @main.errorhandler(413)
 def file_too_large(error):
@@ -138,32 +245,34 @@ def file_too_large(error):
     Callback for attempting to upload a file that is larger than the defined
     file size limit.
     """
-    sizeInMib = main.config['MAX_CONTENT_LENGTH'] // (1024**2)
-    flash(f"You tried to upload a file that was too large. Please only upload files with size up to {sizeInMib}MiB.", "error")
+    flash(FILE_TOO_LARGE_MESSAGE, "error")
     return redirect(url_for("create"))
 
 @main.route("/")
 def splash():
     """Landing page."""
-    return render_template("splash.html")
+    # tag the page with a hash of its content so that browsers revalidating it
+    # get a 304; it is not cached outright since it can show flashed messages
+    response = make_response(render_template("splash.html"))
+    response.add_etag()
+    return response.make_conditional(request)
 
 @main.route("/view", methods=['GET', 'POST'])
 def view():
     """
     Page where users can find elections to vote in or view bulletin boards for.
     """
-    form = ViewElectionForm(request.form)
+    form = ViewElectionForm()
     election = None
     if form.validate_on_submit():
-        election = getElectionFromDb(escape(form.election_id.data.upper()))
+        election = getElectionFromDb(form.election_id.data.upper())
     return render_template("view.html", form=form, election=election)
 
 @main.route("/create", methods=['GET', 'POST'])
 def create():
     """Election creation page."""
-    form = ElectionForm(CombinedMultiDict((request.files, request.form)))
+    form = ElectionForm()
     if form.validate_on_submit():
-        request_list = request.form.to_dict()
         title = form.title.data
         contact = form.contact.data
         delim = form.delimiter.data
@@ -173,101 +282,95 @@ def create():
         
         # validate the questions and choices in the form and construct the
         # question dictionary
-        questions = ElectionForm.validateQuestions(request_list)
+        questions = ElectionForm.validateQuestions(request.form)
         
-        # validate the uploaded file and construct the new file location
-        filepath = ElectionForm.validateFile(form)
+        # validate the uploaded file, only reading the voters from it if the
+        # rest of the form is valid (otherwise they would be thrown away)
+        csv_file = ElectionForm.validateFile(form)
         election_id = makeID()
-        voters = checkCsv(election_id, filepath, delim)
+        voters = None
+        if csv_file is not None and time_tup is not None \
+           and questions is not None:
+            voters = checkCsv(election_id, csv_file.stream, delim)
 
         # check that all validation passed
-        if time_tup is not None and questions is not None \
-           and filepath is not None and voters is not None:
+        if voters is not None:
             # create election and redirect to confirmation
             start_time, end_time = time_tup
             election = parseElection(election_id, questions, start_time, end_time,
                                      title, contact)
-            session['new_election'] = jsonpickle.encode(election)
-            session['voters'] = jsonpickle.encode(voters)
-            session['filepath'] = filepath
-            return redirect(url_for("confirmElection"))
+            # keep the election server-side and only its ID in the session
+            pending_id = generateSession()
+            if insertPendingElection(pending_id, election, voters) is None:
+                flash("Could not save your election, please try again.", "error")
+            else:
+                session['pending_election'] = pending_id
+                return redirect(url_for("confirmElection"))
     return render_template("create.html", form=form, errors=form.errors)
     
 @main.route("/confirm-election", methods=["GET", "POST"])
 def confirmElection():
     """Election creation confirmation page."""
-    if not 'new_election' in session:
-        flash("Election incomplete, ensure that you correctly filled out the election details here.",
-              "error")
-        return redirect(url_for("create"))
-    
-    if not 'filepath' in session:
-        flash("Election incomplete, ensure that you have uploaded the voter CSV file after filling out the election details.",
-              "error")
-        return redirect(url_for("create"))
-
-    if not 'voters' in session:
-        flash("Election incomplete, ensure that you uploaded a non-empty file for voters.",
-              "error")
+    pending_id = session.get('pending_election')
+    election = None if pending_id is None else getPendingElection(pending_id)
+    if election is None:
+        session.pop('pending_election', None)
+        flash(NO_PENDING_ELECTION_MESSAGE, "error")
         return redirect(url_for("create"))
 
-    election = jsonpickle.decode(session['new_election'])
-    filepath = session['filepath']
-    voters = jsonpickle.decode(session['voters'])
-
-    form = SubmitForm(request.form)
+    form = SubmitForm()
 
-    # if valid submission then insert into database
+    # if valid submission then insert into database (only decoding the voters
+    # now since they are not needed to render the page)
     if form.validate_on_submit():
-        inserted = insertElection(election, voters)
+        voters = getPendingVoters(pending_id)
+        inserted = None if voters is None else insertElection(election, voters)
         if inserted is None:
             flash("Election was not inserted successfully", "error")
         else:
-            # delete user file after inserting voters
-            os.remove(filepath)
             flash("Election inserted successfully!", "info")
 
-            # clear session
-            session.pop('new_election')
-            session.pop('filepath')
-            session.pop('voters')
+            # clear the pending election
+            deletePendingElection(pending_id)
+            session.pop('pending_election')
             return redirect(url_for("splash"))    
-    return render_template("confirm_election.html", form=SubmitForm(),
+    return render_template("confirm_election.html", form=form,
                            election=election, questions=election.questions)
 
 
 @main.route("/login", methods=["GET", "POST"])
 def voteLogin():
     """Page to log into an election for voting."""
-    election_id = escape(request.args.get("election_id", ""))
+    election_id = request.args.get("election_id", "")
     if not election_id:
         flash("No election ID given, please pass an election ID and try again.", 'error')
         return redirect(url_for("view"))
 
     # ensure users only login during an ONGOING election
-    status = getElectionStatus(election_id)
-    if status is None:
+    times = getElectionTimes(election_id)
+    if times is None:
         flash(f"Invalid election ID passed: No election found with that ID.", 'error')
         return redirect(url_for("view"))
+    start_time, end_time = times
+    status = checkStatus(start_time, end_time)
     
-    if status.name == "PENDING":
-        flash(f"Election has not started yet! Come back after {election.str_start_time}.", 'error')
+    if status == Status.PENDING:
+        flash(f"Election has not started yet! Come back after {Election.longTime(start_time)}.", 'error')
         return redirect(url_for("view"))
     
-    if status.name == "CLOSED":
+    if status == Status.CLOSED:
         flash(f"Election has closed! Check out its results.", 'error')
-        return redirect(url_for("results"), election_id=election_id)
+        return redirect(url_for("results", election_id=election_id))
 
     # if user is already logged in then send to voting
     if current_user.is_authenticated:
         return redirect(url_for("voting", election_id=election_id,
                                     question_num=current_user.current))
 
-    form = LoginForm(request.form)
+    form = LoginForm()
     if form.validate_on_submit():
         # validate login data
-        voter = getVoterFromDb(escape(form.email.data), escape(form.code.data),
-                                    election_id)
+        voter = getVoterFromDb(form.email.data, form.code.data, election_id)
         if voter is not None:
             # log user into session and send to voting page
             login_user(voter)
@@ -279,50 +382,17 @@ def voteLogin():
     return render_template("login.html", form=form, election_id=election_id,
                            contact=contact)
 
-@main.route("/vote/<string:election_id>/<int:question_num>", methods=["GET", "POST"])
+@main.route("/vote/<election:election_id>/<int:question_num>", methods=["GET", "POST"])
 @login_required
 def voting(election_id: str, question_num: int):
     """Page to vote for some question in an election."""
-    clean_id = escape(election_id)
-    clean_num = int(escape(question_num))
-
-    # make sure that this user is for the correct election!
-    if current_user.election_id != clean_id:
-        flash("Wrong election. Please log into the correct election before trying to vote!", "error")
-        return redirect(url_for("voting", election_id=clean_id,
-                                    question_num=current_user.current))
-    
-    # for users that have finished voting, send them to the results page
-    if current_user.voted:
-        flash("You've already voted! Look at the election bulletin board below", "info")
-        return redirect(url_for("results", election_id=clean_id))
-
-    # make sure that the question number in the request matches the backend
-    if current_user.current != clean_num:
-        flash("Redirected to the correct question number.", "info")
-        return redirect(url_for("voting", election_id=clean_id,
-                                    question_num=current_user.current))
 
-    # sanity check on the election status
-    status = getElectionStatus(clean_id)
-    if status is None:
-        flash("Bad election ID passed, please try again!", "error")
-        return redirect(url_for("view"))
-    
-    if status == "PENDING":
-        flash("That election has not started yet!", 'error')
-        return redirect(url_for("view"))
-
-    if status == "CLOSED":
-        flash("That election has closed! Check out its results below.", 'error')
-        return redirect(url_for("results"), election_id=clean_id)
-    
     # make a Form from the Question object (and request if POST)
-    question = getQuestionByNum(clean_id, clean_num)
+    question = getQuestionByNum(election_id, question_num)
     if question is None:
         flash('Something went wrong when trying to fetch that question', 'error')
-        return redirect(url_for("voteLogin", election_id=clean_id))
-    form = QuestionForm(question, request.form)
+        return redirect(url_for("voteLogin", election_id=election_id))
+    form = QuestionForm(question)
     if form.validate_on_submit():
         if question.is_multi:
             choice = form.q_multi_choice.data
@@ -330,209 +400,146 @@ def voting(election_id: str, question_num: int):
             choice = [form.q_single_choice.data]
 
         # do proofs and make the receipt
-        receipt = firstReceipt(question, clean_id, current_user.voter_id, choice)
+        receipt = firstReceipt(question, election_id, current_user.voter_id, choice)
         if receipt is not None:
-            # sign the SHA-256 hash of the receipt dumped as a JSON string,
-            # and add to session with the public key so we can verify it on
-            # the next page
-            json_str = json.dumps(receipt)
-            hex_json = stringToHex(json_str)
-            session['hash_1'] = hashString(json_str)
-            session['sign_1'] = signData(session['hash_1'], getPrivateKey())
-            session['receipt'] = receipt  
+            # sign the hash of the receipt and add both to the session so we
+            # can verify it on the next page
+            session['hash_1'], session['sign_1'], json_bytes = signReceipt(receipt)
+            session['ballot_id'] = receipt['ballot_id']
+            session['question_id'] = receipt['question_id']
             
             if updateVoteReceipt(session['sign_1'], session['hash_1'], receipt['ballot_id'],
-                                 hex_json, first_stage=True) is None:
+                                 json_bytes, first_stage=True) is None:
                 flash("Could not sign your ballot, please try again.", 'error')
             else:
-                return redirect(url_for("auditOrConfirm", election_id=clean_id,
-                                        question_num=clean_num))
-    contact = getElectionContact(clean_id)
-    return render_template("voting.html", form=form, election_id=clean_id,
+                return redirect(url_for("auditOrConfirm", election_id=election_id,
+                                        question_num=question_num))
+    contact = getElectionContact(election_id)
+    return render_template("voting.html", form=form, election_id=election_id,
                            errors=form.errors, contact=contact)
 
-@main.route("/audit/<string:election_id>/<int:question_num>", methods=["GET", "POST"])
+@main.route("/audit/<election:election_id>/<int:question_num>", methods=["GET", "POST"])
 @login_required
 def auditOrConfirm(election_id: str, question_num: int):
     """
     Page where users are shown their stage one ballot and can choose to
     either audit or confirm it.
     """
-    clean_id = escape(election_id)
-    clean_num = int(escape(question_num))
-
-    # election status and user checks
-    if current_user.election_id != clean_id:
-        flash("Wrong election. Please log into the correct election before trying to vote!", "error")
-        return redirect(url_for("voting", election_id=clean_id,
-                                    question_num=current_user.current))
-    if current_user.voted:
-        flash("You've already voted! Look at the election bulletin board below", "info")
-        return redirect(url_for("results", election_id=clean_id))
-    if current_user.current != clean_num:
-        flash("Redirected to the correct question number.", "info")
-        return redirect(url_for("voting", election_id=clean_id,
-                                    question_num=current_user.current))
-    
-    status = getElectionStatus(clean_id)
-    if status is None:
-        flash("Bad election ID passed, please try again!", "error")
-        return redirect(url_for("view"))
-    if status == "PENDING":
-        flash("That election has not started yet!", 'error')
-        return redirect(url_for("view"))
-    if status == "CLOSED":
-        flash("That election has closed! Check out its results below.", 'error')
-        return redirect(url_for("results"), election_id=clean_id)
 
     # check session contains the expected data
-    if 'sign_1' not in session or 'hash_1' not in session \
-        or 'receipt' not in session:
+    if not session.keys() >= AUDIT_SESSION_KEYS:
         flash('Bad session data, please try again.', 'error')
         clearSession(session)
-        return redirect(url_for('voting', election_id=clean_id,
-                                question_num=clean_num))
+        return redirect(url_for('voting', election_id=election_id,
+                                question_num=question_num))
 
-    # verify session data signature
-    public_key = getPrivateKey().verifying_key
-    if not verifyData(session['hash_1'], public_key, session['sign_1']):
+    # verify the session's receipt signature before acting on it; a GET only
+    # shows the hash, which the signed session cookie already protects
+    if request.method == "POST" and not verifyData(
+            session['hash_1'], getPrivateKey().verifying_key, session['sign_1']):
         flash('Could not verify vote receipt, please try again.', 'error')
         clearSession(session)
-        return redirect(url_for('voting', election_id=clean_id,
-                                question_num=clean_num))
+        return redirect(url_for('voting', election_id=election_id,
+                                question_num=question_num))
     
-    form = AuditForm(request.form)
+    form = AuditForm()
     if form.validate_on_submit():
-        ballot_id = session['receipt']['ballot_id']
+        ballot_id = session['ballot_id']
         # if AUDIT button is clicked, do auditing operations
         if form.audit.data and not form.confirm.data:
             receipt = auditBallot(ballot_id)
             if receipt is None:
                 flash('Could not fetch ballot data, try again.', 'error')
             else:
-                json_str = json.dumps(receipt)
-                hex_json = stringToHex(json_str)
-                session['hash_2'] = hashString(json_str)
-                session['receipt_2'] = receipt
-                session['sign_2'] = signData(session['hash_2'], getPrivateKey())
+                session['hash_2'], session['sign_2'], json_bytes = signReceipt(receipt)
+                session['audited'] = True
                 if updateVoteReceipt(session['sign_2'], session['hash_2'], receipt['ballot_id'],
-                                     hex_json, first_stage=False) \
+                                     json_bytes, first_stage=False) \
                                      is None:
                     flash("Could not sign your ballot, please try again.", 'error')
-                    return redirect(url_for('voting', election_id=clean_id,
-                                            question_num=clean_num))
+                    return redirect(url_for('voting', election_id=election_id,
+                                            question_num=question_num))
 
                 # gets the choices in an easy to print way.
-                choices = ""
-                for choice_dict in receipt['choices']:
-                    if choice_dict['voted']:
-                        choices += f"{choice_dict['choice']}; "
-                session['choices'] = choices[:-2]
-                return redirect(url_for('showBallot', election_id=clean_id,
-                                        question_num=clean_num))
+                session['choices'] = "; ".join(choice_dict['choice']
+                                               for choice_dict in receipt['choices']
+                                               if choice_dict['voted'])
+                return redirect(url_for('showBallot', election_id=election_id,
+                                        question_num=question_num))
         # if CONFIRM button is clicked, do confirmation operations   
         elif not form.audit.data and form.confirm.data:
-            receipt = confirmBallot(ballot_id, len(session['receipt']['choices']))
-            incrementTallies(ballot_id)
-            deleteSecrets(ballot_id)
-            
-            # increment the question counter for the voter
-            current_user.nextQuestion()
-            nextQuestion(current_user.voter_id, current_user.current)
+            receipt = confirmBallot(ballot_id)
+            if receipt is None:
+                flash("Could not confirm your ballot, please try again.", 'error')
+                return redirect(url_for('voting', election_id=election_id,
+                                        question_num=question_num))
+            hash_2, sign_2, json_bytes = signReceipt(receipt)
+            next_question = current_user.current + 1
+            # check if all questions have now been completed
+            finished = next_question > totalQuestions(election_id)
             
-            json_str = json.dumps(receipt)
-            hex_json = stringToHex(json_str)
-            session['hash_2'] = hashString(json_str)
-            session['sign_2'] = signData(session['hash_2'], getPrivateKey())
-            session['receipt_2'] = receipt
-            if updateVoteReceipt(session['sign_2'], session['hash_2'], receipt['ballot_id'],
-                                 hex_json, first_stage=False) \
-                                 is None:
+            # confirm the ballot and move the voter on in one transaction
+            if finalizeVote(ballot_id, current_user.voter_id, next_question,
+                            finished, sign_2, hash_2, json_bytes) is None:
                 flash("Could not sign your ballot, please try again.", 'error')
-                return redirect(url_for('voting', election_id=clean_id,
-                                        question_num=clean_num))
-            # check if all questions have now been completed
-            if current_user.current > totalQuestions(clean_id):
+                return redirect(url_for('voting', election_id=election_id,
+                                        question_num=question_num))
+            current_user.nextQuestion()
+            if finished:
                 current_user.completeVoting()
-                completeVoting(current_user.voter_id)
+            session['hash_2'] = hash_2
+            session['sign_2'] = sign_2
+            session['audited'] = False
             session.pop('sign_1')
-            return redirect(url_for('showBallot', election_id=clean_id,
+            return redirect(url_for('showBallot', election_id=election_id,
                                     question_num=current_user.current))
         else:
             flash('Please either choose to audit or confirm your ballot.', 'error')
     pretty_hash = Markup(prettyReceipt(truncHash(session['hash_1'])))
-    contact = getElectionContact(clean_id)
-    return render_template("audit.html", form=form, election_id=clean_id,
+    contact = getElectionContact(election_id)
+    return render_template("audit.html", form=form, election_id=election_id,
                            pretty_hash=pretty_hash, contact=contact)
 
-@main.route("/ballot/<string:election_id>/<int:question_num>", methods=["GET", "POST"])
+@main.route("/ballot/<election:election_id>/<int:question_num>", methods=["GET", "POST"])
 @login_required
 def showBallot(election_id: str, question_num: int):
     """Page where the user is shown their final stage two ballot."""
-    clean_id = escape(election_id)
-    clean_num = int(escape(question_num))
-
-    # election status and user checks
-    if current_user.election_id != clean_id:
-        flash("Wrong election. Please log into the correct election before trying to vote!", "error")
-        return redirect(url_for("voting", election_id=clean_id,
-                                    question_num=current_user.current))
-    if current_user.current != clean_num:
-        flash("Redirected to the correct question number.", "info")
-        return redirect(url_for("voting", election_id=clean_id,
-                                    question_num=current_user.current))
-    
-    status = getElectionStatus(clean_id)
-    if status is None:
-        flash("Bad election ID passed, please try again!", "error")
-        return redirect(url_for("view"))
-    if status == "PENDING":
-        flash("That election has not started yet!", 'error')
-        return redirect(url_for("view"))
-
-    # note we do not check for CLOSED elections since at this point their
-    # ballot must have been completed before the election has closed and hence
-    # the page should continue to load
 
     # check session data exists
-    if 'hash_2' not in session or 'sign_2' not in session \
-       or 'hash_1' not in session or 'receipt' not in session \
-       or 'receipt_2' not in session:
+    if not session.keys() >= BALLOT_SESSION_KEYS:
         flash('Bad session data, please try again.', 'error')
         clearSession(session)
-        return redirect(url_for('voting', election_id=clean_id,
-                                question_num=clean_num))
+        return redirect(url_for('voting', election_id=election_id,
+                                question_num=question_num))
 
-    # verify session data
-    public_key = getPrivateKey().verifying_key
-    if not verifyData(session['hash_2'], public_key, session['sign_2']):
+    # verify the session's receipt signature before acting on it; a GET only
+    # shows the hash, which the signed session cookie already protects
+    if request.method == "POST" and not verifyData(
+            session['hash_2'], getPrivateKey().verifying_key, session['sign_2']):
         flash('Could not verify vote receipt, please try again.', 'error')
         clearSession(session)
-        return redirect(url_for('voting', election_id=clean_id,
-                                question_num=clean_num))
+        return redirect(url_for('voting', election_id=election_id,
+                                question_num=question_num))
     
-    audited = session['receipt_2']['state'] == 'AUDITED'
-    form = SubmitForm(request.form)
+    audited = session['audited']
+    form = SubmitForm()
     if form.validate_on_submit():
-        session.pop('receipt')
-        session.pop('receipt_2')
-        session.pop('hash_1')
-        session.pop('sign_2')
-        session.pop('hash_2')
-        # only audited ballots have this, so provide the second argument
-        session.pop('choices', None)
-        return redirect(url_for('voting', election_id=clean_id,
-                                question_num=clean_num))
+        # not every ballot has every key (e.g. only audited ballots have
+        # choices), so provide the second argument
+        for key in VOTE_SESSION_KEYS:
+            session.pop(key, None)
+        return redirect(url_for('voting', election_id=election_id,
+                                question_num=question_num))
     pretty_hash = Markup(prettyReceipt(truncHash(session['hash_1'])))
-    contact = getElectionContact(clean_id)
-    return render_template("ballot.html", election_id=clean_id, form=form,
+    contact = getElectionContact(election_id)
+    return render_template("ballot.html", election_id=election_id, form=form,
                            audited=audited, pretty_hash=pretty_hash, contact=contact)
 
-@main.route("/results/<string:election_id>", methods=["GET"])
+@main.route("/results/<election:election_id>", methods=["GET"])
+@compress.compressed()
 def results(election_id: str):
     """Bulletin board page."""
-    clean_id = escape(election_id)
-    election = getElectionFromDb(clean_id)
+    election = getElectionFromDb(election_id)
     if election is None:
         flash("Could not find an election with that ID!", "error")
         return redirect(url_for("view"))
@@ -552,27 +559,35 @@ def results(election_id: str):
     # fetch all the ballots to display
     receipts = getBallots(election)
     
-    return render_template("bulletin.html", receipt_list=receipts, contact=election.contact,
-                           trunc=truncHash, election=election, totals=totals,
-                           graph_dict=graph_dict)
-
-@main.route("/download_json/<string:election_id>", methods=["GET"])
+    # tag the page with a hash of its content so that revisiting an unchanged
+    # bulletin board gets a 304 rather than the whole page again
+    response = make_response(render_template("bulletin.html", receipt_list=receipts,
+                                             contact=election.contact, trunc=truncHash,
+                                             election=election, totals=totals,
+                                             graph_dict=graph_dict))
+    response.add_etag()
+    return response.make_conditional(request)
+
+@main.route("/download_json/<election:election_id>", methods=["GET"])
 def download(election_id: str):
-    clean_id = escape(election_id)
-    election = getElectionFromDb(clean_id)
-    if election is None:
+    times = getElectionTimes(election_id)
+    if times is None:
         flash("Could not find an election with that ID!", "error")
         return redirect(url_for("view"))
 
-    if election.status.name != "CLOSED":
+    if checkStatus(*times) != Status.CLOSED:
         flash("The election has not finished yet so you cannot download the JSON file yet.", "error")
         return redirect(url_for("view"))
 
-    filename = f"{clean_id}.json"
+    filename = f"{election_id}.json"
 
-    if makeElectionJson(election) is None:
-        flash("Could not create JSON file for verification.", "error")
-        return redirect(url_for("view"))
+    # the file never changes once it has been made after the election closed,
+    # so only load the whole election if it has not been made yet
+    if not os.path.exists(os.path.join(main.config['JSON_FOLDER'], filename)):
+        election = getElectionFromDb(election_id)
+        if election is None or not makeElectionJson(election):
+            flash("Could not create JSON file for verification.", "error")
+            return redirect(url_for("view"))
     
     return send_from_directory(main.config['JSON_FOLDER'], filename,
-                               as_attachment=True)
+                               as_attachment=True, max_age=JSON_MAX_AGE)
@@ -0,0 +1,24 @@
+-- Run after schema.sql by 'init-db' and on their own by 'migrate-db', so these
+-- must be safe to run again on a database that is already up to date. Later
+-- additions to the schema go here so that older databases pick them up
+-- without losing their data.
+
+-- elections that have been created but not yet confirmed, stored as JSON
+CREATE TABLE IF NOT EXISTS pending_elections (
+  pending_id VARCHAR PRIMARY KEY,
+  election BLOB NOT NULL,
+  voters BLOB NOT NULL,
+  created DATETIME NOT NULL
+);
+
+-- lookups made on every login, vote and bulletin board request
+CREATE INDEX IF NOT EXISTS idx_voters_login ON voters (election_id, uname);
+CREATE INDEX IF NOT EXISTS idx_questions_election ON questions (election_id, question_num);
+CREATE INDEX IF NOT EXISTS idx_ballots_election ON ballots (election_id, ballot_id);
+CREATE INDEX IF NOT EXISTS idx_receipts_ballot ON receipts (ballot_id);
+
+-- each ballot has its own ID. This replaces the earlier non-unique index, which
+-- is only dropped once the unique one is built. runMigrations() refuses to run
+-- this file while duplicate IDs are in the table
+CREATE UNIQUE INDEX IF NOT EXISTS idx_ballots_unique_id ON ballots (ballot_id);
+DROP INDEX IF EXISTS idx_ballots_id;
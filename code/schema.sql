@@ -5,6 +5,7 @@ DROP TABLE IF EXISTS ballots;
 DROP TABLE IF EXISTS receipts;
 DROP TABLE IF EXISTS choices;
 DROP TABLE IF EXISTS keys;
+DROP TABLE IF EXISTS pending_elections;
 
 CREATE TABLE keys (
   private_k VARCHAR NOT NULL,
@@ -81,4 +82,4 @@ CREATE TABLE choices (
   sum_total VARCHAR,
   PRIMARY KEY (question_id, index_num),
   FOREIGN KEY (question_id) REFERENCES questions(question_id) ON DELETE CASCADE
-);
\ No newline at end of file
+);